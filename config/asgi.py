@@ -13,4 +13,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up. /status/wait and /status/stream are
+# served here so clients waiting on a job never occupy a Django worker.
+from main.events import with_status_routes
+from main.reaper import start_reaper
+
+application = with_status_routes(django_application)
+start_reaper()
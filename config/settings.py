@@ -17,6 +17,11 @@ import dj_database_url
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Runtime state (the file cache, job status, media expiry, face indexes and
+# profiles) lives here rather than next to the code. Point it at a
+# persistent volume in production; each path below can also be set alone.
+VAR_DIR = os.environ.get('VAR_DIR', os.path.join(BASE_DIR, 'var'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -43,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,7 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware"
+    "main.middleware.WhiteNoiseMiddleware"
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -86,6 +92,24 @@ else:
     }
 
 
+# Shared by every process, so a model save invalidates cached pages in all
+# of them: Redis when REDIS_URL is set, otherwise a directory on disk.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(VAR_DIR, 'django_cache'),
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -125,6 +149,75 @@ STATICFILES_DIRS = [BASE_DIR / 'main' / 'static']
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# ClipSniper: number of processes that scan one upload in parallel shards.
+# 0 or 1 keeps the single-process scan.
+CLIPSNIPER_SCAN_WORKERS = int(os.environ.get('CLIPSNIPER_SCAN_WORKERS', '0'))
+
+# ClipSniper: jobs run on a bounded in-process pool. Uploads are refused
+# with HTTP 429 once this many jobs are already waiting.
+CLIPSNIPER_MAX_CONCURRENT_JOBS = int(os.environ.get('CLIPSNIPER_MAX_CONCURRENT_JOBS', '1'))
+CLIPSNIPER_MAX_QUEUED_JOBS = int(os.environ.get('CLIPSNIPER_MAX_QUEUED_JOBS', '20'))
+
+# ClipSniper: follow faces across frames by box overlap and reuse a face's
+# match decision instead of re-running recognition on every frame.
+CLIPSNIPER_FACE_TRACKER = os.environ.get('CLIPSNIPER_FACE_TRACKER', '1') == '1'
+
+# ClipSniper: skip the detector on sampled frames where no cell of the
+# downscaled grayscale signature differs from the last inferred frame by
+# this much (0-255 scale). 0 disables the gate.
+CLIPSNIPER_MOTION_THRESHOLD = float(os.environ.get('CLIPSNIPER_MOTION_THRESHOLD', '8.0'))
+
+# ClipSniper: per-video face index (boxes + float16 embeddings) keyed by the
+# video's content hash, so a re-query with another photo skips inference.
+# Kept outside MEDIA_ROOT because embeddings must not be publicly served.
+CLIPSNIPER_FACE_INDEX = os.environ.get('CLIPSNIPER_FACE_INDEX', '1') == '1'
+CLIPSNIPER_FACE_INDEX_ROOT = os.environ.get('CLIPSNIPER_FACE_INDEX_ROOT', os.path.join(VAR_DIR, 'face_index'))
+CLIPSNIPER_FACE_INDEX_MAX_BYTES = int(os.environ.get('CLIPSNIPER_FACE_INDEX_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# ClipSniper: job status store. "sqlite" is shared by every process on the
+# host, "redis" across hosts, "memory" only within one process. Progress
+# writes closer together than CLIPSNIPER_STATUS_MIN_INTERVAL seconds are
+# dropped; statuses expire CLIPSNIPER_STATUS_TTL seconds after the last write.
+CLIPSNIPER_STATUS_BACKEND = os.environ.get('CLIPSNIPER_STATUS_BACKEND', 'sqlite')
+CLIPSNIPER_STATUS_PATH = os.environ.get('CLIPSNIPER_STATUS_PATH', os.path.join(VAR_DIR, 'job_status.sqlite3'))
+CLIPSNIPER_REDIS_URL = os.environ.get('CLIPSNIPER_REDIS_URL', 'redis://localhost:6379/0')
+CLIPSNIPER_STATUS_TTL = int(os.environ.get('CLIPSNIPER_STATUS_TTL', '3600'))
+CLIPSNIPER_STATUS_MIN_INTERVAL = float(os.environ.get('CLIPSNIPER_STATUS_MIN_INTERVAL', '1.0'))
+
+# ClipSniper: largest video accepted through the chunked upload API
+# (multipart uploads stay capped at 25 MB).
+CLIPSNIPER_MAX_CHUNKED_UPLOAD_SIZE = int(os.environ.get('CLIPSNIPER_MAX_CHUNKED_UPLOAD_SIZE', str(500 * 1024 * 1024)))
+# Chunked uploads in progress at once, per client address and in total
+# bytes reserved; uploads idle for five minutes stop counting.
+CLIPSNIPER_MAX_UPLOADS_PER_CLIENT = int(os.environ.get('CLIPSNIPER_MAX_UPLOADS_PER_CLIENT', '2'))
+CLIPSNIPER_MAX_ACTIVE_UPLOAD_BYTES = int(os.environ.get('CLIPSNIPER_MAX_ACTIVE_UPLOAD_BYTES', str(2 * 1024 * 1024 * 1024)))
+
+# ClipSniper: media housekeeping. Outputs and cache entries are deleted
+# CLIPSNIPER_OUTPUT_TTL seconds after their job; unregistered scratch files
+# older than CLIPSNIPER_ORPHAN_AGE are treated as left by failed jobs; and
+# media/output is kept under CLIPSNIPER_MEDIA_MAX_BYTES, oldest first.
+CLIPSNIPER_OUTPUT_TTL = int(os.environ.get('CLIPSNIPER_OUTPUT_TTL', '3600'))
+CLIPSNIPER_ORPHAN_AGE = int(os.environ.get('CLIPSNIPER_ORPHAN_AGE', str(6 * 3600)))
+CLIPSNIPER_MEDIA_MAX_BYTES = int(os.environ.get('CLIPSNIPER_MEDIA_MAX_BYTES', str(5 * 1024 * 1024 * 1024)))
+CLIPSNIPER_REAP_INTERVAL = int(os.environ.get('CLIPSNIPER_REAP_INTERVAL', '60'))
+# Every web process runs a reaper thread every CLIPSNIPER_REAP_INTERVAL
+# seconds. Set CLIPSNIPER_REAPER=0 to run `manage.py reap_media` from cron
+# instead, e.g. once a minute.
+CLIPSNIPER_REAPER = os.environ.get('CLIPSNIPER_REAPER', '1') == '1'
+CLIPSNIPER_EXPIRY_DB = os.environ.get('CLIPSNIPER_EXPIRY_DB', os.path.join(VAR_DIR, 'media_expiry.sqlite3'))
+
+# ClipSniper: /metrics is served to staff and to scrapers sending this
+# value as a bearer token. Staff can profile a single job by submitting it
+# with profile=1; its folded stack samples land in CLIPSNIPER_PROFILE_DIR.
+CLIPSNIPER_METRICS_TOKEN = os.environ.get('CLIPSNIPER_METRICS_TOKEN', '')
+CLIPSNIPER_PROFILE_DIR = os.environ.get('CLIPSNIPER_PROFILE_DIR', os.path.join(VAR_DIR, 'profiles'))
+CLIPSNIPER_PROFILE_INTERVAL = float(os.environ.get('CLIPSNIPER_PROFILE_INTERVAL', '0.01'))
+
+# Identifies the deployed build (e.g. a git commit) so cached pages from a
+# previous deploy are not served; empty means a digest of the app's code
+# and templates, computed once per process.
+BUILD_ID = os.environ.get('BUILD_ID', '')
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 # Default primary key field type
@@ -0,0 +1,140 @@
+import os
+import resource
+import shutil
+import time
+import uuid
+import cv2
+import numpy as np
+from django.test.utils import override_settings
+
+from . import timings
+from .inference import PRESETS
+from .timings import STAGES
+
+# End-to-end benchmark of process_video_job on generated fixtures, so runs
+# are comparable across machines and commits without shipping videos. The
+# fixture video alternates scenes with and without the same face over a
+# moving background; the reference photo is a flipped, rescaled copy of
+# that face, so the detector and the recogniser both have real work to do.
+
+# Stages faster than this are too noisy to gate on.
+MIN_REGRESSION_SECONDS = 0.05
+
+def sample_face():
+    # A face photo that ships with insightface, so no download is needed.
+    from insightface.data import get_image
+    return get_image("Tom_Hanks_54745")
+
+def make_fixtures(directory, face, frames=300, fps=25, width=1280, height=720, scene_frames=50):
+    # Writes <directory>/video.mp4 and <directory>/reference.jpg; returns
+    # their paths and the indices of the frames that show the face.
+    os.makedirs(directory, exist_ok=True)
+    video_path = os.path.join(directory, "video.mp4")
+    reference_path = os.path.join(directory, "reference.jpg")
+    face_height = height // 3
+    face = cv2.resize(face, (max(1, face.shape[1] * face_height // face.shape[0]), face_height))
+    reference = cv2.flip(face, 1)
+    cv2.imwrite(reference_path, cv2.resize(reference, (reference.shape[1] * 3 // 4, reference.shape[0] * 3 // 4)))
+
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 40, (height, width * 2, 3), dtype=np.uint8)
+    ramp = np.linspace(40, 200, width * 2, dtype=np.uint8)[None, :, None]
+    background = cv2.add(np.broadcast_to(ramp, noise.shape).copy(), noise)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    with_face = []
+    try:
+        for idx in range(frames):
+            shift = (idx * 4) % width
+            frame = background[:, shift:shift + width].copy()
+            if (idx // scene_frames) % 2 == 0:
+                x = (width - face.shape[1]) * (idx % scene_frames) // scene_frames
+                y = (height - face_height) // 2
+                frame[y:y + face_height, x:x + face.shape[1]] = face
+                with_face.append(idx)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return video_path, reference_path, with_face
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+def run_once(video_path, reference_path, work_dir, mode, stride=1):
+    # Runs one job on copies of the fixtures (the job deletes its inputs)
+    # with its own media root, no face index and in-process scanning, so
+    # every stage runs and is timed. Returns the run's measurements.
+    from .status import get_status_store
+    from .views import process_video_job
+
+    media_root = os.path.join(work_dir, "media")
+    os.makedirs(os.path.join(media_root, "temp"), exist_ok=True)
+    job_id = f"bench-{uuid.uuid4().hex}"
+    video_copy = os.path.join(media_root, "temp", f"{job_id}.mp4")
+    reference_copy = os.path.join(media_root, "temp", f"{job_id}.jpg")
+    shutil.copyfile(video_path, video_copy)
+    shutil.copyfile(reference_path, reference_copy)
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    with override_settings(MEDIA_ROOT=media_root, CLIPSNIPER_FACE_INDEX=False, CLIPSNIPER_SCAN_WORKERS=1,
+                           CLIPSNIPER_EXPIRY_DB=os.path.join(work_dir, "expiry.sqlite3")):
+        recorder = timings.start_recording()
+        started = time.perf_counter()
+        try:
+            process_video_job(job_id, video_copy, [("person", [reference_copy], PRESETS[mode]["threshold"])],
+                              stride=stride, workers=1, mode=mode)
+        finally:
+            wall = time.perf_counter() - started
+            timings.stop_recording()
+    result = get_status_store().get(job_id) or {}
+    get_status_store().delete(job_id)
+    if result.get("error"):
+        raise RuntimeError(result["error"])
+    output_bytes = 0
+    output_dir = os.path.join(media_root, "output")
+    for name in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        if name.startswith(job_id):
+            output_bytes += os.path.getsize(os.path.join(output_dir, name))
+    return {
+        "wall_seconds": round(wall, 6),
+        "stages": recorder.as_dict(),
+        "frames": total_frames,
+        "frames_inferred": result.get("frames_inferred", 0),
+        "fps": round(total_frames / wall, 2) if wall else 0.0,
+        "segments": sum(len(person["segments"]) for person in result.get("people", [])),
+        "output_bytes": output_bytes,
+    }
+
+def summarize(runs):
+    # Median of each measurement over the runs, so one slow run (a cold
+    # cache, a noisy neighbour) does not decide the result.
+    def median(values):
+        return float(np.median(values)) if values else 0.0
+    return {
+        "wall_seconds": round(median([r["wall_seconds"] for r in runs]), 6),
+        "fps": round(median([r["fps"] for r in runs]), 2),
+        "stages": {name: round(median([r["stages"][name]["seconds"] for r in runs]), 6) for name in STAGES},
+        "frames": runs[0]["frames"],
+        "frames_inferred": runs[0]["frames_inferred"],
+        "segments": runs[0]["segments"],
+        "output_bytes": runs[0]["output_bytes"],
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+def regressions(result, baseline, tolerance):
+    # Human-readable lines for every measurement that got worse than the
+    # baseline by more than `tolerance` (a fraction); empty when none did.
+    found = []
+    for name in STAGES:
+        now = result["stages"].get(name, 0.0)
+        before = baseline["stages"].get(name, 0.0)
+        if now - before > MIN_REGRESSION_SECONDS and now > before * (1 + tolerance):
+            found.append(f"{name}: {before:.3f}s -> {now:.3f}s")
+    if baseline.get("fps") and result["fps"] < baseline["fps"] * (1 - tolerance):
+        found.append(f"fps: {baseline['fps']:.1f} -> {result['fps']:.1f}")
+    if baseline.get("peak_rss_bytes") and result["peak_rss_bytes"] > baseline["peak_rss_bytes"] * (1 + tolerance):
+        found.append(f"peak RSS: {baseline['peak_rss_bytes'] / 2**20:.0f} MB -> {result['peak_rss_bytes'] / 2**20:.0f} MB")
+    return found
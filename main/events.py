@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+# Push-style job progress, served straight from the ASGI app rather than
+# through Django's view stack (its sync middleware would pin a thread to
+# every waiting client). Status writes reach the broker through the status
+# store's listeners; a waiting client is an asyncio future, so 500 clients
+# waiting on a job cost 500 futures and no threads.
+
+LONG_POLL_TIMEOUT = 25
+SSE_KEEPALIVE = 15
+STATUS_WAIT_PATH = "/status/wait"
+STATUS_STREAM_PATH = "/status/stream"
+# Final statuses stay in the broker this long for clients that ask just
+# after a job finishes; after that they come from the store.
+FINAL_RETENTION = 300
+
+def is_final(data):
+    return bool(data.get("done") or data.get("message") or data.get("error"))
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+class StatusBroker:
+    # Keeps the latest (version, status) of every running job and wakes the
+    # futures waiting for a version newer than theirs. Futures may belong to
+    # any event loop; they are resolved on their own loop.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._finished = {}
+        self._waiters = {}
+
+    def publish(self, job_id, data):
+        now = time.monotonic()
+        with self._lock:
+            version = self._latest.get(job_id, (0, None))[0] + 1
+            self._latest[job_id] = (version, data)
+            if is_final(data):
+                self._finished[job_id] = now
+            for finished_id, finished_at in list(self._finished.items()):
+                if now - finished_at > FINAL_RETENTION:
+                    del self._finished[finished_id]
+                    self._latest.pop(finished_id, None)
+            waiters = self._waiters.pop(job_id, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, (version, data))
+        return version
+
+    def current(self, job_id):
+        with self._lock:
+            return self._latest.get(job_id, (0, None))
+
+    def waiting(self, job_id=None):
+        with self._lock:
+            if job_id is not None:
+                return len(self._waiters.get(job_id, []))
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def wait(self, job_id, version, timeout):
+        # (version, status) once the job publishes something newer than
+        # `version`, or None after `timeout` seconds.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            latest = self._latest.get(job_id)
+            if latest and latest[0] > version:
+                return latest
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.setdefault(job_id, []).append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(job_id)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._waiters[job_id]
+
+broker = StatusBroker()
+
+async def _read_status(job_id):
+    # The store may be SQLite or Redis, so the read goes to a worker thread
+    # and is given back before the client starts waiting.
+    from .jobs import job_status
+    return await asyncio.to_thread(job_status, job_id)
+
+async def _send_json(send, status, data):
+    body = json.dumps(data).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"cache-control", b"no-store")]})
+    await send({"type": "http.response.body", "body": body})
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def long_poll(job_id, version, send):
+    # Without a version the current status is returned at once; with one the
+    # response is held until the job publishes something newer, or until the
+    # timeout, when the client simply asks again.
+    if version is not None:
+        result = await broker.wait(job_id, version, LONG_POLL_TIMEOUT)
+        if result is not None:
+            version, data = result
+            await _send_json(send, 200, dict(data, version=version))
+            return
+    data = await _read_status(job_id)
+    await _send_json(send, 200, dict(data, version=max(broker.current(job_id)[0], version or 0)))
+
+async def event_stream(job_id, send, receive):
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"), (b"cache-control", b"no-store"),
+        (b"x-accel-buffering", b"no")]})
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        version = broker.current(job_id)[0]
+        data = await _read_status(job_id)
+        while True:
+            await send({"type": "http.response.body", "more_body": True,
+                        "body": f"id: {version}\ndata: {json.dumps(data)}\n\n".encode()})
+            if is_final(data):
+                break
+            waiting = asyncio.ensure_future(broker.wait(job_id, version, SSE_KEEPALIVE))
+            await asyncio.wait([waiting, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                waiting.cancel()
+                return
+            result = waiting.result()
+            if result is not None:
+                version, data = result
+                continue
+            # Nothing published here in a while: the job may be queued or
+            # running in another process, so look at the store again.
+            fresh = await _read_status(job_id)
+            if fresh == data:
+                await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+                continue
+            data = fresh
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+
+async def status_app(scope, receive, send):
+    query = parse_qs(scope.get("query_string", b"").decode())
+    job_id = query.get("job_id", [""])[0]
+    if scope["method"] != "GET":
+        await _send_json(send, 405, {"error": "GET required"})
+    elif not job_id:
+        await _send_json(send, 400, {"error": "job_id required"})
+    elif scope["path"] == STATUS_STREAM_PATH:
+        await event_stream(job_id, send, receive)
+    else:
+        try:
+            version = int(query["version"][0]) if "version" in query else None
+        except ValueError:
+            version = None
+        await long_poll(job_id, version, send)
+
+def with_status_routes(app):
+    # Wraps the Django ASGI app so the status endpoints bypass it.
+    async def application(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in (STATUS_WAIT_PATH, STATUS_STREAM_PATH):
+            await status_app(scope, receive, send)
+        else:
+            await app(scope, receive, send)
+    return application
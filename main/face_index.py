@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+
+INDEX_VERSION = 3
+EMBEDDING_DIM = 512
+# Age after which a leftover writer scratch directory is removed.
+SCRATCH_MAX_AGE = 24 * 3600
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Per-face rows of an index: a float16 box and a float16 L2-normalised
+# embedding, stored as flat little-endian files so they can be appended to
+# while scanning and memory-mapped when matching.
+ROWS = (("boxes.bin", 4), ("embeddings.bin", EMBEDDING_DIM))
+
+def _scratch_dir(root):
+    path = os.path.join(root, f".{uuid.uuid4().hex}.tmp")
+    os.makedirs(path)
+    return path
+
+def _rows(path, name, width, count, mode="r"):
+    if not count:
+        return np.zeros((0, width), dtype=np.float16)
+    return np.memmap(os.path.join(path, name), dtype="<f2", mode=mode, shape=(count, width))
+
+class FaceIndexWriter:
+    # Streams the faces seen on every inferred frame of a scan into a
+    # scratch directory under root; only each frame's number and face count
+    # stay in memory. frames[i] owns rows offsets[i]:offsets[i + 1] of the
+    # row files. frame_limit drops frames at or past it (a shard's
+    # look-ahead frame, which belongs to the next shard). Frames the motion
+    # gate carried are recorded by repeat() and get a copy of their source
+    # frame's rows in finish().
+    def __init__(self, root, digest, fps, total_frames, stride, frame_limit=None):
+        self.root = root
+        self.digest = digest
+        self.meta = {"version": INDEX_VERSION, "fps": fps, "total_frames": total_frames, "stride": stride}
+        self.frame_limit = frame_limit
+        os.makedirs(root, exist_ok=True)
+        self.path = _scratch_dir(root)
+        self.frames = []
+        self.counts = []
+        self.repeats = []
+        self._files = [open(os.path.join(self.path, name), "wb") for name, _ in ROWS]
+
+    def add(self, idx, faces):
+        if self.frame_limit is not None and idx >= self.frame_limit:
+            return
+        faces = [f for f in faces if f.embedding is not None]
+        boxes = np.array([f.bbox for f in faces], dtype=np.float32).reshape(-1, 4)
+        embeddings = np.array([f.embedding for f in faces], dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if len(embeddings):
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        for f, rows in zip(self._files, (boxes, embeddings)):
+            f.write(rows.astype("<f2").tobytes())
+        self.frames.append(idx)
+        self.counts.append(len(faces))
+
+    def repeat(self, idx, source_idx):
+        if self.frame_limit is not None and idx >= self.frame_limit:
+            return
+        self.repeats.append((idx, source_idx))
+
+    def finish(self):
+        # Closes the row files and puts frames in order, since gaps
+        # re-scanned around an edge arrive after the sample that follows
+        # them. Returns the part directory for merge_parts.
+        for f in self._files:
+            f.close()
+        if self.repeats:
+            self._copy_repeats()
+        frames = np.array(self.frames, dtype=np.int32)
+        counts = np.array(self.counts, dtype=np.int64)
+        order = np.argsort(frames, kind="stable")
+        if np.any(order != np.arange(len(order))):
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            for name, width in ROWS:
+                rows = _rows(self.path, name, width, int(offsets[-1]))
+                with open(os.path.join(self.path, name + ".sorted"), "wb") as out:
+                    for i in order:
+                        out.write(np.asarray(rows[offsets[i]:offsets[i + 1]]).tobytes())
+                del rows
+                os.replace(os.path.join(self.path, name + ".sorted"), os.path.join(self.path, name))
+            frames, counts = frames[order], counts[order]
+        np.save(os.path.join(self.path, "frames.npy"), frames)
+        np.save(os.path.join(self.path, "counts.npy"), counts)
+        return self.path
+
+    def _copy_repeats(self):
+        offsets = np.concatenate([[0], np.cumsum(self.counts, dtype=np.int64)])
+        position = {idx: i for i, idx in enumerate(self.frames)}
+        copies = [(idx, position[source]) for idx, source in self.repeats if source in position]
+        for name, width in ROWS:
+            rows = _rows(self.path, name, width, int(offsets[-1]))
+            with open(os.path.join(self.path, name), "ab") as out:
+                for _, i in copies:
+                    out.write(np.asarray(rows[offsets[i]:offsets[i + 1]]).tobytes())
+            del rows
+        for idx, i in copies:
+            self.frames.append(idx)
+            self.counts.append(self.counts[i])
+        self.repeats = []
+
+    def save(self):
+        return merge_parts(self.root, self.digest, [self.finish()], self.meta)
+
+    def discard(self):
+        for f in self._files:
+            f.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def merge_parts(root, digest, part_paths, meta):
+    # Joins finished parts, given in frame order (one per shard, or a single
+    # serial scan), into the index for `digest`, replacing any older one.
+    path = os.path.join(root, digest)
+    tmp_path = _scratch_dir(root)
+    try:
+        for name, _ in ROWS:
+            if len(part_paths) == 1:
+                os.replace(os.path.join(part_paths[0], name), os.path.join(tmp_path, name))
+                continue
+            with open(os.path.join(tmp_path, name), "wb") as out:
+                for part in part_paths:
+                    with open(os.path.join(part, name), "rb") as f:
+                        shutil.copyfileobj(f, out)
+        frames = np.concatenate([np.load(os.path.join(part, "frames.npy")) for part in part_paths] or [np.zeros(0, np.int32)])
+        counts = np.concatenate([np.load(os.path.join(part, "counts.npy")) for part in part_paths] or [np.zeros(0, np.int64)])
+        np.save(os.path.join(tmp_path, "frames.npy"), frames.astype(np.int32))
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        for part in part_paths:
+            shutil.rmtree(part, ignore_errors=True)
+    return path
+
+class FaceIndex:
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.frames = np.load(os.path.join(path, "frames.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.boxes, self.embeddings = (
+            _rows(path, name, width, int(self.offsets[-1])) for name, width in ROWS)
+        self.fps = self.meta["fps"]
+        self.total_frames = self.meta["total_frames"]
+
+    def frame_hits(self, gallery, max_faces=3, chunk_rows=65536):
+        # (frames, people) boolean. Each chunk of the memory-mapped embeddings
+        # is matched against the whole gallery with one matrix product.
+        counts = np.diff(self.offsets)
+        owner = np.repeat(np.arange(len(self.frames)), counts)
+        rank = np.arange(len(owner)) - self.offsets[owner]
+        face_hits = np.zeros((len(owner), len(gallery.labels)), dtype=bool)
+        for start in range(0, len(owner), chunk_rows):
+            block = np.asarray(self.embeddings[start:start + chunk_rows], dtype=np.float32)
+            face_hits[start:start + len(block)] = gallery.match_embeddings(block)
+        face_hits &= (rank < max_faces)[:, None]
+        hits = np.zeros((len(self.frames), len(gallery.labels)), dtype=bool)
+        np.logical_or.at(hits, owner, face_hits)
+        return hits
+
+    def match(self, gallery, max_faces=3):
+        # Same fill rule as scan_frames: frames between two consecutive
+        # indexed frames that both match a person are matched too. Edges are
+        # exact where the indexing scan refined densely, elsewhere they are
+        # as precise as the stride the index was built with.
+        hits = self.frame_hits(gallery, max_faces)
+        by_label = {}
+        for p, label in enumerate(gallery.labels):
+            person_hits = hits[:, p]
+            matched = [self.frames[person_hits]]
+            for i in np.flatnonzero(person_hits[:-1] & person_hits[1:]):
+                matched.append(np.arange(self.frames[i] + 1, self.frames[i + 1]))
+            frames = sorted(int(idx) for idx in np.concatenate(matched))
+            if frames:
+                by_label[label] = frames
+        return by_label
+
+def load_index(root, digest, stride=None):
+    # None when there is no usable index, including one built at a coarser
+    # stride than `stride`: its edges away from the first query's would be
+    # less precise than the scan being asked for.
+    path = os.path.join(root, digest)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    try:
+        index = FaceIndex(path)
+    except (OSError, ValueError, KeyError):
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    if index.meta.get("version") != INDEX_VERSION:
+        return None
+    if stride is not None and index.meta.get("stride", 1) > stride:
+        return None
+    # Touch meta.json so eviction sees this index as recently used.
+    os.utime(os.path.join(path, "meta.json"))
+    return index
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+def enforce_budget(root, max_bytes):
+    # Least recently used indexes go first until the total fits the budget.
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    for entry in os.scandir(root):
+        if entry.name.startswith("."):
+            # Scratch directory of a writer; one left by a crash goes once
+            # it is clearly abandoned.
+            if entry.is_dir() and time.time() - entry.stat().st_mtime > SCRATCH_MAX_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            continue
+        meta_path = os.path.join(entry.path, "meta.json")
+        if entry.is_dir() and os.path.exists(meta_path):
+            entries.append((os.path.getmtime(meta_path), _dir_size(entry.path), entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        evicted.append(path)
+    return evicted
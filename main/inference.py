@@ -0,0 +1,235 @@
+import copy
+import threading
+import cv2
+import numpy as np
+
+from .metrics import FACES_PER_FRAME
+from .timings import stage
+
+DEFAULT_BATCH_SIZE = 4
+MAX_BATCH_SIZE = 32
+DEFAULT_THRESHOLD = 0.45
+EMBEDDING_DIM = 512
+
+# Speed/quality presets. det_size is the detector's input size, max_height
+# the height frames are downscaled to before detection (None keeps the
+# source size), max_faces how many faces per frame are recognised and
+# threshold the default similarity threshold. Recognition always runs on
+# crops from the full-resolution frame.
+PRESETS = {
+    "fast": {"det_size": (320, 320), "max_height": 480, "max_faces": 2, "threshold": 0.5},
+    "balanced": {"det_size": (640, 640), "max_height": None, "max_faces": 3, "threshold": DEFAULT_THRESHOLD},
+    "accurate": {"det_size": (960, 960), "max_height": None, "max_faces": 5, "threshold": 0.4},
+}
+DEFAULT_MODE = "balanced"
+
+def load_model(root, ctx_id=-1, threads=None):
+    from insightface.app import FaceAnalysis
+    model = FaceAnalysis(name='buffalo_sc', root=root)
+    model.prepare(ctx_id=ctx_id)
+    if threads:
+        # insightface does not forward session options, so rebuild the
+        # sessions to pin onnxruntime's thread pool (one per shard worker
+        # keeps several workers from oversubscribing the cores).
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        for task_model in model.models.values():
+            task_model.session = onnxruntime.InferenceSession(
+                task_model.model_file, sess_options=options,
+                providers=task_model.session.get_providers())
+    return model
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_model(root):
+    # Loaded on the first ClipSniper job rather than at import, so web
+    # workers that never run a job and management commands do not import
+    # insightface/onnxruntime or hold a copy of the model. One instance per
+    # process is shared by all job threads; onnxruntime sessions are safe to
+    # run concurrently.
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model(root)
+    return _model
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+class Gallery:
+    # Reference embeddings for every person in a job, stacked person by
+    # person into one normalised matrix so all faces of a batch are matched
+    # against all references with a single product.
+    def __init__(self, people):
+        self.labels = []
+        thresholds = []
+        rows = []
+        starts = []
+        for label, embeddings, threshold in people:
+            starts.append(len(rows))
+            rows.extend(embeddings)
+            self.labels.append(label)
+            thresholds.append(threshold)
+        self.matrix = normalize_rows(rows)
+        self.starts = np.array(starts, dtype=np.intp)
+        self.thresholds = np.array(thresholds, dtype=np.float32)
+
+    def match_embeddings(self, embeddings):
+        # (faces, people) boolean: best similarity to any of that person's
+        # references is above the person's threshold.
+        embeddings = normalize_rows(embeddings)
+        if not len(embeddings):
+            return np.zeros((0, len(self.labels)), dtype=bool)
+        sims = embeddings @ self.matrix.T
+        best = np.maximum.reduceat(sims, self.starts, axis=1)
+        return best > self.thresholds
+
+def match_frames(model, items, gallery, max_faces=3, on_faces=None, tracker=None, det_size=None, max_height=None):
+    # One label set per frame: the people whose reference matched any of the
+    # frame's first max_faces faces. With a tracker, faces that continue a
+    # track whose decision is still fresh are not embedded again; they reuse
+    # the track's labels and embedding.
+    frames = [frame for _, frame in items]
+    with stage("detect"):
+        detected = detect_faces_batch(model, frames, det_size, max_height)
+    faces_per_frame = []
+    for faces in detected:
+        FACES_PER_FRAME.observe(len(faces))
+        faces_per_frame.append(faces[:max_faces])
+    if tracker is None:
+        tracks_per_frame = None
+        pending = [(frame, face) for frame, faces in zip(frames, faces_per_frame) for face in faces]
+    else:
+        tracks_per_frame = []
+        pending = []
+        for (idx, frame), faces in zip(items, faces_per_frame):
+            tracks = tracker.update(idx, faces)
+            for face, track in zip(faces, tracks):
+                if tracker.needs_embedding(track, idx):
+                    track.pending = (idx, face)
+                    pending.append((frame, face))
+            tracks_per_frame.append(tracks)
+    with stage("embed"):
+        embed_faces(model, pending)
+    with stage("match"):
+        face_hits = gallery.match_embeddings([face.embedding for _, face in pending])
+        labels_by_face = {}
+        for (_, face), person_hits in zip(pending, face_hits):
+            labels_by_face[id(face)] = frozenset(gallery.labels[p] for p in np.flatnonzero(person_hits))
+    if tracker is not None:
+        for tracks in tracks_per_frame:
+            for track in tracks:
+                if track.pending is not None:
+                    idx, face = track.pending
+                    tracker.verified(track, idx, face.embedding, labels_by_face[id(face)])
+    hits = []
+    for i, ((idx, _), faces) in enumerate(zip(items, faces_per_frame)):
+        labels = set()
+        for j, face in enumerate(faces):
+            if id(face) in labels_by_face:
+                labels |= labels_by_face[id(face)]
+            else:
+                track = tracks_per_frame[i][j]
+                face.embedding = track.embedding
+                labels |= track.labels
+        if on_faces:
+            on_faces(idx, faces)
+        hits.append(frozenset(labels))
+    return hits
+
+class _BatchSlice:
+    # Stands in for the detector's onnxruntime session so SCRFD.detect can
+    # reuse its own pre/post-processing on one image of a batch that has
+    # already been pushed through the network.
+    def __init__(self, outputs, index):
+        self.outputs = outputs
+        self.index = index
+
+    def run(self, output_names, input_feed):
+        return [out[self.index:self.index + 1] for out in self.outputs]
+
+def _letterbox(img, input_size):
+    # Same resize-and-pad that SCRFD.detect applies before building its blob.
+    im_ratio = float(img.shape[0]) / img.shape[1]
+    model_ratio = float(input_size[1]) / input_size[0]
+    if im_ratio > model_ratio:
+        new_height = input_size[1]
+        new_width = int(new_height / im_ratio)
+    else:
+        new_width = input_size[0]
+        new_height = int(new_width * im_ratio)
+    det_img = np.zeros((input_size[1], input_size[0], 3), dtype=np.uint8)
+    det_img[:new_height, :new_width, :] = cv2.resize(img, (new_width, new_height))
+    return det_img
+
+def detect_batch(det_model, frames, input_size=None):
+    input_size = input_size or det_model.input_size
+    # Detectors exported without a batch axis (the buffalo packs) can only
+    # take one image per run, so they keep the per-frame path.
+    if len(frames) == 1 or not getattr(det_model, "batched", False):
+        return [det_model.detect(frame, input_size=input_size, max_num=0, metric='default') for frame in frames]
+    blob = cv2.dnn.blobFromImages(
+        [_letterbox(frame, input_size) for frame in frames],
+        1.0 / det_model.input_std, input_size,
+        (det_model.input_mean, det_model.input_mean, det_model.input_mean), swapRB=True)
+    outputs = det_model.session.run(det_model.output_names, {det_model.input_name: blob})
+    results = []
+    for i, frame in enumerate(frames):
+        view = copy.copy(det_model)
+        view.session = _BatchSlice(outputs, i)
+        results.append(view.detect(frame, input_size=input_size, max_num=0, metric='default'))
+    return results
+
+def downscale(frame, max_height):
+    # (frame, scale) with the frame shrunk to max_height if it is taller.
+    height, width = frame.shape[:2]
+    if not max_height or height <= max_height:
+        return frame, 1.0
+    scale = max_height / height
+    return cv2.resize(frame, (max(1, int(round(width * scale))), max_height), interpolation=cv2.INTER_AREA), scale
+
+def detect_faces_batch(model, frames, det_size=None, max_height=None):
+    from insightface.app.common import Face
+
+    scaled = [downscale(frame, max_height) for frame in frames]
+    detections = detect_batch(model.det_model, [small for small, _ in scaled], det_size)
+    faces_per_frame = []
+    for frame, (_, scale), (bboxes, kpss) in zip(frames, scaled, detections):
+        faces = []
+        for i in range(bboxes.shape[0]):
+            # Boxes and landmarks are mapped back to the source frame, so
+            # alignment and recognition crop from full resolution.
+            kps = kpss[i] / scale if kpss is not None else None
+            face = Face(bbox=bboxes[i, 0:4] / scale, kps=kps, det_score=bboxes[i, 4])
+            for taskname, task_model in model.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    task_model.get(frame, face)
+            faces.append(face)
+        faces_per_frame.append(faces)
+    return faces_per_frame
+
+def embed_faces(model, pairs):
+    # pairs: [(frame, face)]. Every crop goes through the recognition model
+    # in a single call.
+    from insightface.utils import face_align
+
+    rec_model = model.models.get('recognition')
+    if rec_model is None or not pairs:
+        return
+    crops = [face_align.norm_crop(frame, landmark=face.kps, image_size=rec_model.input_size[0]) for frame, face in pairs]
+    for (_, face), embedding in zip(pairs, rec_model.get_feat(crops)):
+        face.embedding = embedding.flatten()
+
+def get_faces_batch(model, frames, max_faces=None):
+    # Batched equivalent of calling model.get(frame) for each frame: detection
+    # runs on the whole batch where the detector allows it, and every face
+    # crop in the batch goes through the recognition model in one call.
+    faces_per_frame = detect_faces_batch(model, frames)
+    embed_faces(model, [(frame, face) for frame, faces in zip(frames, faces_per_frame) for face in faces[:max_faces]])
+    return faces_per_frame
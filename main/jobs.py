@@ -0,0 +1,163 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from django.conf import settings
+
+from .metrics import QUEUE_WAIT, JOB_DURATION, JOBS_IN_FLIGHT
+from .status import get_status_store
+
+# Jobs are addressed by what they compute: the video, the reference photos
+# and every parameter that changes the result. A finished job is served from
+# media/cache/<key>.json for as long as its outputs are kept, and a job that
+# is still running absorbs duplicate submissions.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def hash_upload(uploaded_file):
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+def job_key(video_digest, people, params):
+    # people: [(label, [image digests], threshold)]
+    payload = {
+        "video": video_digest,
+        "people": [[label, sorted(digests), round(threshold, 4)] for label, digests, threshold in people],
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def cache_path(key):
+    return os.path.join(settings.MEDIA_ROOT, "cache", f"{key}.json")
+
+def cached_job(key):
+    path = cache_path(key)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    # Outputs, status and the cache entry expire together, but a restart can
+    # leave one without the others; only serve entries that are complete.
+    if all(os.path.exists(p) for p in entry.get("paths", [])) and get_status_store().get(entry["job_id"]) is not None:
+        return entry["job_id"]
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return None
+
+def claim(key, job_id):
+    # Returns the job that will produce this result: an in-flight or cached
+    # one if there is one, otherwise job_id, which is now registered.
+    with _inflight_lock:
+        existing = _inflight.get(key) or cached_job(key)
+        if existing:
+            return existing
+        _inflight[key] = job_id
+        return job_id
+
+def store_result(key, job_id, paths):
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"job_id": job_id, "paths": paths}, f)
+    os.replace(tmp_path, path)
+    return path
+
+def release(key):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+class QueueFull(Exception):
+    pass
+
+class JobScheduler:
+    # A fixed number of worker threads pull jobs from a priority queue (lower
+    # number first, FIFO within a priority). Submissions beyond max_queued
+    # waiting jobs are refused instead of piling more CPU-bound work on the
+    # process.
+    def __init__(self, max_workers, max_queued, default_duration=60.0):
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max_queued
+        self.default_duration = default_duration
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = itertools.count()
+        self.running = {}
+        self.durations = deque(maxlen=20)
+        self.workers = []
+
+    def submit(self, job_id, fn, *args, priority=0, **kwargs):
+        with self.cond:
+            if len(self.queue) >= self.max_queued:
+                raise QueueFull(job_id)
+            heapq.heappush(self.queue, (priority, next(self.seq), job_id, fn, args, kwargs, time.monotonic()))
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, daemon=True)
+                self.workers.append(worker)
+                worker.start()
+            self.cond.notify()
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                _, _, job_id, fn, args, kwargs, queued_at = heapq.heappop(self.queue)
+                started = self.running[job_id] = time.monotonic()
+            QUEUE_WAIT.observe(started - queued_at)
+            JOBS_IN_FLIGHT.inc()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"[ERROR] Job {job_id} failed: {e}")
+            finally:
+                JOBS_IN_FLIGHT.dec()
+                with self.cond:
+                    duration = time.monotonic() - self.running.pop(job_id)
+                    self.durations.append(duration)
+                JOB_DURATION.observe(duration)
+
+    def average_duration(self):
+        if not self.durations:
+            return self.default_duration
+        return sum(self.durations) / len(self.durations)
+
+    def position(self, job_id):
+        # (1-based queue position, estimated seconds until the job finishes),
+        # or None once the job has left the queue.
+        with self.cond:
+            waiting = [entry[2] for entry in sorted(self.queue)]
+            if job_id not in waiting:
+                return None
+            pos = waiting.index(job_id) + 1
+            average = self.average_duration()
+            now = time.monotonic()
+            # Work ahead of this job: what is left of the running jobs plus
+            # every job queued in front of it, spread over the workers.
+            ahead = sum(max(average - (now - started), 0) for started in self.running.values())
+            ahead += (pos - 1) * average
+            return pos, round(ahead / self.max_workers + average)
+
+scheduler = JobScheduler(settings.CLIPSNIPER_MAX_CONCURRENT_JOBS, settings.CLIPSNIPER_MAX_QUEUED_JOBS)
+
+def job_status(job_id):
+    # What check_status and the push endpoints report: the queue position
+    # while the job waits, then whatever the job last wrote.
+    queued = scheduler.position(job_id)
+    if queued:
+        position, eta = queued
+        return {"done": False, "progress": 0, "queue_position": position, "eta_seconds": eta}
+    data = get_status_store().get(job_id)
+    if data is None:
+        return {"done": False, "progress": 0}
+    return data
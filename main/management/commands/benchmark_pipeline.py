@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import make_fixtures, run_once, sample_face, summarize, regressions
+from main.inference import PRESETS, DEFAULT_MODE
+from main.timings import STAGES
+
+class Command(BaseCommand):
+    help = ('Run process_video_job end to end on a generated video and report per-stage timings, '
+            'frames/sec, peak RSS and output size. Fails when a stage is slower than the saved baseline '
+            'by more than --tolerance.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=300, help='Length of the generated video')
+        parser.add_argument('--width', type=int, default=1280)
+        parser.add_argument('--height', type=int, default=720)
+        parser.add_argument('--fps', type=int, default=25)
+        parser.add_argument('--face', help='Photo to build the fixtures from instead of the insightface sample')
+        parser.add_argument('--mode', choices=sorted(PRESETS), default=DEFAULT_MODE)
+        parser.add_argument('--stride', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs to take the median of')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'pipeline_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown per stage as a fraction of the baseline')
+
+    def handle(self, *args, **options):
+        if options['face']:
+            import cv2
+            face = cv2.imread(options['face'])
+            if face is None:
+                raise CommandError(f"Cannot read {options['face']}")
+        else:
+            try:
+                face = sample_face()
+            except ImportError:
+                raise CommandError("insightface is not installed; pass --face.")
+        config = {key: options[key] for key in ('frames', 'width', 'height', 'fps', 'mode', 'stride')}
+        config['face'] = os.path.basename(options['face']) if options['face'] else 'insightface-sample'
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            video_path, reference_path, _ = make_fixtures(
+                os.path.join(work_dir, 'fixtures'), face, frames=options['frames'], fps=options['fps'],
+                width=options['width'], height=options['height'])
+            runs = []
+            for i in range(max(1, options['repeat'])):
+                try:
+                    runs.append(run_once(video_path, reference_path, work_dir, options['mode'], options['stride']))
+                except RuntimeError as e:
+                    raise CommandError(f"Run {i + 1} failed: {e}")
+        result = {'config': config, **summarize(runs), 'runs': runs}
+        self.report(result)
+
+        if options['output']:
+            self.write_json(options['output'], result)
+        if options['save_baseline']:
+            self.write_json(options['baseline'], result)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {options['baseline']}"))
+            return
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(f"No baseline at {options['baseline']}; run with --save-baseline to create one.")
+            return
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            raise CommandError(f"The baseline was recorded with {baseline.get('config')}, not {config}.")
+        found = regressions(result, baseline, options['tolerance'])
+        if found:
+            raise CommandError("Regressed against the baseline:\n  " + "\n  ".join(found))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def write_json(self, path, result):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    def report(self, result):
+        wall = result['wall_seconds']
+        self.stdout.write(f"frames:    {result['frames']} ({result['frames_inferred']} inferred, {result['segments']} segments)")
+        self.stdout.write(f"wall:      {wall:.2f}s, {result['fps']:.1f} frames/s")
+        for name in STAGES:
+            seconds = result['stages'][name]
+            share = seconds / wall if wall else 0.0
+            self.stdout.write(f"  {name:<8} {seconds:>8.3f}s {share:>7.1%}")
+        self.stdout.write(f"peak RSS:  {result['peak_rss_bytes'] / 2**20:.0f} MB")
+        self.stdout.write(f"output:    {result['output_bytes'] / 1024:.0f} KB")
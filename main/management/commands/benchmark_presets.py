@@ -0,0 +1,51 @@
+import os
+import time
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+from main.inference import get_model, match_frames, Gallery, PRESETS
+from main.scanner import read_frames, scan_frames, frames_by_label
+from main.views import extract_embeddings, model_root
+
+class Command(BaseCommand):
+    help = 'Scan a video at stride 1 with every ClipSniper preset and report throughput and recall'
+
+    def add_arguments(self, parser):
+        parser.add_argument('video')
+        parser.add_argument('images', nargs='+', help='Reference photos of the person to look for')
+        parser.add_argument('--frames', type=int, default=None, help='Only scan the first N frames')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['video']):
+            raise CommandError(f"No such video: {options['video']}")
+        model = get_model(model_root)
+        embeddings = []
+        for image_path in options['images']:
+            try:
+                embeddings.append(extract_embeddings(image_path, model))
+            except ValueError as e:
+                raise CommandError(f"{image_path}: {e}")
+
+        # Accurate runs first: its matches are the reference for recall.
+        results = {}
+        for mode in sorted(PRESETS, key=lambda m: m != "accurate"):
+            preset = PRESETS[mode]
+            gallery = Gallery([("person", embeddings, preset["threshold"])])
+            cap = cv2.VideoCapture(options['video'])
+            started = time.perf_counter()
+            matched, inferred = scan_frames(
+                read_frames(cap, 0, options['frames']),
+                lambda items: match_frames(
+                    model, items, gallery, max_faces=preset["max_faces"],
+                    det_size=preset["det_size"], max_height=preset["max_height"]),
+            )
+            elapsed = time.perf_counter() - started
+            cap.release()
+            results[mode] = (set(frames_by_label(matched).get("person", [])), inferred, elapsed)
+
+        reference = results["accurate"][0]
+        self.stdout.write(f"{'mode':<10} {'frames':>7} {'fps':>8} {'matched':>8} {'recall':>7}")
+        for mode in PRESETS:
+            frames, inferred, elapsed = results[mode]
+            recall = len(frames & reference) / len(reference) if reference else 1.0
+            self.stdout.write(f"{mode:<10} {inferred:>7} {inferred / elapsed:>8.1f} {len(frames):>8} {recall:>7.1%}")
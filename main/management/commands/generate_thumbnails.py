@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from main.models import BlogPost, Project
+from main.thumbnails import generate_derivatives
+
+class Command(BaseCommand):
+    help = 'Generate the resized WebP and fallback thumbnails of blog posts and projects that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate every thumbnail')
+
+    def handle(self, *args, **options):
+        written = 0
+        for model in (BlogPost, Project):
+            for name in model.objects.exclude(thumbnail='').exclude(thumbnail=None).values_list('thumbnail', flat=True).iterator():
+                try:
+                    written += len(generate_derivatives(name, force=options['force']))
+                except Exception as e:
+                    self.stderr.write(f'Could not generate thumbnails for {name}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} thumbnail files'))
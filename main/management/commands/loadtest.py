@@ -0,0 +1,120 @@
+import asyncio
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = ('Load a running ClipSniper server with concurrent (optionally slow) clients and report '
+            'requests/sec and latency percentiles. Run it once against the WSGI server and once '
+            'against the ASGI one to compare them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Server base URL, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--path', default='/check_status?job_id=loadtest', help='Path for GET requests')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--upload', help='POST this video with --image to /clipsniper_demo/ instead of GET --path')
+        parser.add_argument('--image', help='Reference photo sent with --upload')
+        parser.add_argument('--upload-rate', type=int, default=0,
+                            help='Throttle each upload to this many KB/s to simulate slow clients (0 = no limit)')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("Only plain http:// URLs are supported.")
+        if options['upload'] and not options['image']:
+            raise CommandError("--upload needs --image.")
+        self.host = url.hostname
+        self.port = url.port or 80
+        results = asyncio.run(self.run(options))
+        self.report(results)
+
+    async def http(self, method, path, headers=(), body=b"", rate=0):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", "Connection: close",
+                    f"Content-Length: {len(body)}", *headers]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+            if rate:
+                # Trickle the body in 100 ms slices.
+                chunk = max(1, rate * 1024 // 10)
+                for start in range(0, len(body), chunk):
+                    writer.write(body[start:start + chunk])
+                    await writer.drain()
+                    await asyncio.sleep(0.1)
+            else:
+                writer.write(body)
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        status_line, _, rest = response.partition(b"\r\n")
+        return int(status_line.split()[1]), rest
+
+    async def csrf_token(self):
+        _, response = await self.http("GET", "/clipsniper_demo/")
+        match = re.search(rb"csrftoken=([^;\s]+)", response)
+        if not match:
+            raise CommandError("The server did not set a CSRF cookie.")
+        return match.group(1).decode()
+
+    def multipart(self, fields):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, filename, content in fields:
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n")
+        return boundary, b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+    async def run(self, options):
+        if options['upload']:
+            token = await self.csrf_token()
+            with open(options['upload'], 'rb') as f:
+                video = f.read()
+            with open(options['image'], 'rb') as f:
+                image = f.read()
+            boundary, body = self.multipart([
+                ("video", os.path.basename(options['upload']), video),
+                ("image", os.path.basename(options['image']), image),
+            ])
+            request = ("POST", "/clipsniper_demo/", [
+                f"Content-Type: multipart/form-data; boundary={boundary}",
+                f"Cookie: csrftoken={token}", f"X-CSRFToken: {token}",
+            ], body, options['upload_rate'])
+        else:
+            request = ("GET", options['path'], [], b"", 0)
+
+        latencies = []
+        statuses = Counter()
+        remaining = iter(range(options['requests']))
+
+        async def client():
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    status, _ = await self.http(*request)
+                except (OSError, ValueError, IndexError) as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+        return latencies, statuses, time.perf_counter() - started
+
+    def report(self, results):
+        latencies, statuses, elapsed = results
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f"requests:  {len(latencies)} in {elapsed:.2f}s")
+        self.stdout.write(f"req/sec:   {len(latencies) / elapsed:.1f}")
+        self.stdout.write(f"latency:   p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, p99 {percentile(0.99):.1f} ms")
+        self.stdout.write("statuses:  " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
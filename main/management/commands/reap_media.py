@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.reaper import reap, get_expiry_index
+from main.status import get_status_store
+
+class Command(BaseCommand):
+    help = 'Delete expired ClipSniper outputs, orphaned temp files, and outputs over the disk budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--max-bytes', type=int, default=None, help='Override CLIPSNIPER_MEDIA_MAX_BYTES')
+
+    def handle(self, *args, **options):
+        max_bytes = options['max_bytes'] if options['max_bytes'] is not None else settings.CLIPSNIPER_MEDIA_MAX_BYTES
+        expired, orphaned, evicted = reap(get_expiry_index(), settings.MEDIA_ROOT, max_bytes, dry_run=options['dry_run'])
+        purged = 0 if options['dry_run'] else get_status_store().purge_expired()
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {expired} expired, {orphaned} orphaned and {evicted} over-budget files; '
+            f'purged {purged} expired job statuses'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.models import BlogPost
+
+class Command(BaseCommand):
+    help = 'Render the stored HTML of blog posts whose content changed or that were never rendered'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render every post')
+
+    def handle(self, *args, **options):
+        rendered = 0
+        for post in BlogPost.objects.iterator():
+            if post.render_content(force=options['force']):
+                post.save(update_fields=['content_html', 'content_hash'])
+                rendered += 1
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} blog posts'))
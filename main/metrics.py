@@ -0,0 +1,156 @@
+import bisect
+import threading
+from collections import deque
+
+# In-process metrics served in the Prometheus text format at /metrics.
+# Recording never waits on a lock: observations are appended to a deque
+# (atomic in CPython) and folded into the totals by whoever reads the
+# metric, or by a recording thread that finds a long backlog and the fold
+# lock free. Each process keeps its own numbers; scan shards running in
+# worker processes are not counted.
+
+# Pending observations per metric before a recording thread folds them.
+FOLD_BACKLOG = 10000
+
+REGISTRY = []
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._pending = deque()
+        self._fold_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _record(self, key, value):
+        self._pending.append((key, value))
+        if len(self._pending) > FOLD_BACKLOG and self._fold_lock.acquire(blocking=False):
+            try:
+                self._drain()
+            finally:
+                self._fold_lock.release()
+
+    def _drain(self):
+        while True:
+            try:
+                key, value = self._pending.popleft()
+            except IndexError:
+                return
+            self._apply(key, value)
+
+    def collect(self):
+        # Folds the backlog and returns the metric's sample lines.
+        with self._fold_lock:
+            self._drain()
+            return self._samples()
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.collect()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        self._record(self._key(labels), amount)
+
+    def _apply(self, key, amount):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(self.values.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self._record(self._key(labels), -amount)
+
+    def set(self, value, **labels):
+        self._record(self._key(labels), ("set", value))
+
+    def _apply(self, key, value):
+        if isinstance(value, tuple):
+            self.values[key] = value[1]
+        else:
+            super()._apply(key, value)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, value, **labels):
+        self._record(self._key(labels), value)
+
+    def _apply(self, key, value):
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        # counts[i] holds values in (buckets[i-1], buckets[i]]; the last
+        # slot holds everything above the largest bucket.
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def _samples(self):
+        lines = []
+        for key in sorted(self.counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self.counts[key]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(self.sums[key])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+def render_metrics():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+QUEUE_WAIT = Histogram(
+    "clipsniper_job_queue_wait_seconds", "Time a ClipSniper job waited for a worker.",
+    (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800))
+JOB_DURATION = Histogram(
+    "clipsniper_job_duration_seconds", "Time a ClipSniper job ran once it had a worker.",
+    (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+JOBS_IN_FLIGHT = Gauge("clipsniper_jobs_in_flight", "ClipSniper jobs currently running.")
+STAGE_SECONDS = Histogram(
+    "clipsniper_stage_seconds", "Time per call of a pipeline stage (one frame, batch, segment or cut).",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60), ("stage",))
+FRAMES_INFERRED = Counter("clipsniper_frames_inferred_total", "Frames the face detector ran on.")
+INFERENCE_FPS = Histogram(
+    "clipsniper_job_inference_fps", "Frames inferred per second of job run time.",
+    (1, 2, 5, 10, 20, 50, 100, 200, 500))
+FACES_PER_FRAME = Histogram("clipsniper_faces_per_frame", "Faces detected per inferred frame.", (0, 1, 2, 3, 5, 10, 20))
+REQUEST_SECONDS = Histogram(
+    "clipsniper_http_request_duration_seconds", "Time to produce a response, by view.",
+    LATENCY_BUCKETS, ("view", "method", "status"))
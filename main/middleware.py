@@ -0,0 +1,73 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from .metrics import REQUEST_SECONDS
+
+KNOWN_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    # WhiteNoise's middleware is sync-only, and a single sync-only middleware
+    # makes Django run the whole stack, async views included, on a thread
+    # per request under ASGI. This one serves static files the same way but
+    # lets everything else through without leaving the event loop.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=None):
+        if settings is None:
+            super().__init__(get_response)
+        else:
+            super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+class RequestMetricsMiddleware:
+    # Times every response into clipsniper_http_request_duration_seconds,
+    # labelled by URL name rather than path so slugs and job ids do not
+    # each become a series. Outermost in MIDDLEWARE, so the time covers
+    # every other middleware too.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started):
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "static" if request.path.startswith("/static/") else "unmatched"
+        method = request.method if request.method in KNOWN_METHODS else "other"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, view=view, method=method, status=response.status_code)
+
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:49
+
+from django.db import migrations, models
+
+
+# The full-text index differs per database, so it is created with raw SQL
+# for whichever one the migration runs on (see main/search.py).
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE main_blogpost_fts USING fts5(title, content, tokenize='porter unicode61')")
+        schema_editor.execute(
+            "INSERT INTO main_blogpost_fts (rowid, title, content) SELECT id, title, content FROM main_blogpost")
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE main_blogpost ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED")
+        schema_editor.execute(
+            "CREATE INDEX blogpost_search_vector ON main_blogpost USING GIN (search_vector)")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS main_blogpost_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS blogpost_search_vector")
+        schema_editor.execute("ALTER TABLE main_blogpost DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_blogpost_content_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['-created_at', '-id'], name='blogpost_created_id'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
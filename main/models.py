@@ -1,17 +1,48 @@
 from django.db import models
+from django.core.cache import cache
 from django.utils.text import slugify
 
+from .rendering import render_markdown, content_hash, cache_key
+from .search import index_post
+
 class BlogPost(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, blank=True)
     thumbnail = models.ImageField(upload_to='blog_thumbs/', null=True, blank=True)
     content = models.TextField(help_text="Write in Markdown.")
+    content_html = models.TextField(blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Serves the newest-first listing and its keyset pages.
+        indexes = [models.Index(fields=['-created_at', '-id'], name='blogpost_created_id')]
+
+    def render_content(self, force=False):
+        # Returns True if the stored HTML was out of date (or force is set)
+        # and has been re-rendered.
+        digest = content_hash(self.content)
+        if not force and digest == self.content_hash and self.content_html:
+            return False
+        if self.content_hash:
+            cache.delete(cache_key(self.content_hash))
+        if force:
+            # post_html reads the cache first, so the entry for the current
+            # content has to go too.
+            cache.delete(cache_key(digest))
+        self.content_html = render_markdown(self.content)
+        self.content_hash = digest
+        return True
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
+        if self.render_content() and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'content_html', 'content_hash'}
         super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'title', 'content'} & set(update_fields):
+            index_post(self)
 
     def __str__(self):
         return self.title
@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+SIGNATURE_SIZE = (64, 36)
+
+def frame_signature(frame):
+    small = cv2.resize(frame, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+class MotionGate:
+    # Cheap pre-filter in front of the face model. Each frame is reduced to a
+    # small grayscale signature; while no cell of it differs from the same
+    # cell of the last inferred frame by `threshold` or more (on the 0-255
+    # scale) the scene is treated as unchanged and that frame's result is
+    # carried forward. The largest cell difference is used rather than the
+    # mean, so a small face entering or leaving an otherwise static shot
+    # still trips the gate. Comparing against the last inferred frame means
+    # slow drift trips it too, and `max_skip` forces a fresh inference after
+    # that many carried samples.
+    # Only sampled frames go through the gate: scan_frames runs the frames
+    # it re-scans around an edge straight through the model.
+    # on_skip(idx, source_idx) is called for every carried frame with the
+    # inferred frame whose result it took, so the face index can record the
+    # same faces for it and keep the spacing of the stride it was built at.
+    def __init__(self, threshold=8.0, max_skip=4, on_skip=None):
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.on_skip = on_skip
+        self.reference = None
+        self.reference_idx = None
+        self.result = None
+        self.run = 0
+        self.skipped = 0
+
+    def __call__(self, items, match_batch):
+        signatures = [frame_signature(frame) for _, frame in items]
+        order = []
+        source = []
+        carried_from = []
+        for k, signature in enumerate(signatures):
+            static = (
+                self.reference is not None
+                and self.run < self.max_skip
+                and float(np.max(np.abs(signature - self.reference))) < self.threshold
+            )
+            if static:
+                self.run += 1
+                carried_from.append((items[k][0], self.reference_idx))
+            else:
+                order.append(k)
+                self.reference = signature
+                self.reference_idx = items[k][0]
+                self.run = 0
+            source.append(len(order) - 1)
+        results = match_batch([items[k] for k in order]) if order else []
+        if self.on_skip:
+            for idx, source_idx in carried_from:
+                self.on_skip(idx, source_idx)
+        carried = self.result
+        if results:
+            self.result = results[-1]
+        self.skipped += len(items) - len(order)
+        return [results[s] if s >= 0 else carried for s in source]
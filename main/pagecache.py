@@ -0,0 +1,93 @@
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+# The public pages only change when an admin edits a BlogPost or Project,
+# so all of them share one content version (see signals.py). A page is
+# cached under the current version, and its ETag/Last-Modified derive from
+# it, so a save or delete invalidates every page at once and browsers and
+# crawlers revalidate with a 304. A deploy that changes the code or
+# templates counts as an edit too: the first request a process serves
+# compares the build with the one the cache last saw and bumps the version
+# if they differ.
+VERSION_KEY = "portfolio:content_version"
+BUILD_KEY = "portfolio:build"
+PAGE_TIMEOUT = 24 * 3600
+
+_build_checked = False
+
+def build_id():
+    # BUILD_ID from the deploy, or else a digest of the app's code and
+    # templates, which is what the pages are rendered with.
+    if settings.BUILD_ID:
+        return settings.BUILD_ID
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(app_dir):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith((".py", ".html")):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, app_dir).encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+def _check_build():
+    global _build_checked
+    if _build_checked:
+        return
+    _build_checked = True
+    build = build_id()
+    if cache.get(BUILD_KEY) != build:
+        bump_content_version()
+        cache.set(BUILD_KEY, build, None)
+
+def bump_content_version():
+    now = time.time()
+    cache.set(VERSION_KEY, (f"{now:.6f}", now), None)
+
+def content_version(request=None):
+    # (version, last modified timestamp), looked up once per request.
+    value = getattr(request, "_content_version", None)
+    if value is None:
+        _check_build()
+        now = time.time()
+        cache.add(VERSION_KEY, (f"{now:.6f}", now), None)
+        value = cache.get(VERSION_KEY) or (f"{now:.6f}", now)
+        if request is not None:
+            request._content_version = value
+    return value
+
+def _page_etag(request, *args, **kwargs):
+    version, _ = content_version(request)
+    return hashlib.md5(f"{version}:{request.get_full_path()}".encode()).hexdigest()
+
+def _page_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(content_version(request)[1], tz=timezone.utc)
+
+def cached_page(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return view(request, *args, **kwargs)
+        key = f"page:{_page_etag(request)}"
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response["Content-Type"]), PAGE_TIMEOUT)
+        # Always revalidate; with a matching ETag that is a bodiless 304.
+        patch_cache_control(response, public=True, max_age=0)
+        return response
+    return condition(etag_func=_page_etag, last_modified_func=_page_last_modified)(wrapper)
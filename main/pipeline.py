@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+
+from .timings import stage
+from .video import cut_segment, concat_parts
+
+FRAME_QUEUE_DEPTH = 32
+_DONE = object()
+
+def threaded_frames(frames, maxsize=FRAME_QUEUE_DEPTH):
+    # Decode on a background thread so cap.read() overlaps inference. The
+    # bounded queue keeps at most `maxsize` decoded frames in memory no
+    # matter how long the video is.
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in frames:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+class StreamingSegments:
+    # Incremental group_timestamps: matched timestamps arrive in order and a
+    # segment is released once the scan has moved more than max_gap past its
+    # end, since no later match can extend it any more.
+    def __init__(self, fps, max_gap=0.5, min_length=0.1):
+        self.fps = fps
+        self.max_gap = max_gap
+        self.min_length = min_length
+        self.start = self.prev = None
+        self.segments = []
+
+    def add(self, timestamps, scanned_until=None):
+        confirmed = []
+        for t in timestamps:
+            if self.start is None:
+                self.start = self.prev = t
+            elif t - self.prev <= self.max_gap:
+                self.prev = t
+            else:
+                self._close(confirmed)
+                self.start = self.prev = t
+        if self.start is not None and scanned_until is not None and scanned_until - self.prev > self.max_gap:
+            self._close(confirmed)
+        return confirmed
+
+    def flush(self):
+        confirmed = []
+        if self.start is not None:
+            self._close(confirmed)
+        return confirmed
+
+    def _close(self, confirmed):
+        segment = (self.start, self.prev + 1/self.fps)
+        self.start = self.prev = None
+        if segment[1] - segment[0] > self.min_length:
+            self.segments.append(segment)
+            confirmed.append(segment)
+
+class SegmentWriter:
+    # Cuts confirmed segments out of the source on a background thread while
+    # the scan is still running, then stitches the parts together.
+    def __init__(self, video_path, work_dir, prefix):
+        self.video_path = video_path
+        self.work_dir = work_dir
+        self.prefix = prefix
+        self.parts = []
+        self.error = None
+        self.cancelled = False
+        self.queue = queue.Queue()
+        os.makedirs(work_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, segments):
+        for segment in segments:
+            self.queue.put(segment)
+
+    def _run(self):
+        while True:
+            segment = self.queue.get()
+            if segment is None:
+                return
+            if self.error or self.cancelled:
+                continue
+            part_path = os.path.join(self.work_dir, f"{self.prefix}_part{len(self.parts)}.mp4")
+            try:
+                with stage("encode"):
+                    cut_segment(self.video_path, segment[0], segment[1], part_path)
+                self.parts.append(part_path)
+            except Exception as e:
+                self.error = e
+                _remove(part_path)
+
+    def finish(self, output_path):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+        if not self.parts:
+            return None
+        with stage("encode"):
+            concat_parts(self.parts, output_path)
+        return output_path
+
+    def cleanup(self):
+        # Safe after finish() and after a failure: segments still queued are
+        # skipped, and the parts are removed only once the thread has exited,
+        # so a cut in progress cannot leave one behind.
+        self.cancelled = True
+        self.queue.put(None)
+        self.thread.join()
+        for part_path in self.parts:
+            _remove(part_path)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+
+# Sampling profiler for a single job, switched on per submission by staff.
+# A thread snapshots every other thread's stack every `interval` seconds and
+# counts identical stacks; the result is written in the folded format that
+# flamegraph.pl and speedscope read, one "thread;outer;...;inner count"
+# line per stack. Only one job is profiled at a time, since the samples of
+# two jobs running side by side could not be told apart.
+
+_profiling = threading.Lock()
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+@contextmanager
+def profile_job(job_id, enabled=True):
+    # Profiles the body if `enabled` and no other job is being profiled;
+    # the samples go to CLIPSNIPER_PROFILE_DIR/<job_id>.folded.
+    if not enabled or not _profiling.acquire(blocking=False):
+        if enabled:
+            print(f"[WARNING] Job {job_id}: another job is being profiled, running without the profiler")
+        yield
+        return
+    profiler = SamplingProfiler(settings.CLIPSNIPER_PROFILE_INTERVAL)
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        _profiling.release()
+        path = os.path.join(settings.CLIPSNIPER_PROFILE_DIR, f"{job_id}.folded")
+        try:
+            profiler.write(path)
+            print(f"[INFO] Job {job_id}: {sum(profiler.stacks.values())} samples over "
+                  f"{time.perf_counter() - started:.1f}s written to {path}")
+        except OSError as e:
+            print(f"[WARNING] Job {job_id}: could not write the profile: {e}")
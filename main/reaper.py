@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+from django.conf import settings
+
+# Every file a job leaves behind is registered here with the time it may be
+# deleted. The index is a SQLite table ordered by expiry, so it survives
+# restarts and one reaper thread per process replaces a sleeping thread per
+# job. Each pass also removes files nobody registered (left by failed jobs
+# or a crash) and trims media/output to the disk budget, oldest first.
+
+# Directories under MEDIA_ROOT the reaper manages, with how old an
+# unregistered file must be before it counts as orphaned. Scratch space
+# gets more slack because running jobs and slow uploads are still using it.
+def managed_dirs():
+    return {
+        "output": settings.CLIPSNIPER_OUTPUT_TTL,
+        "cache": settings.CLIPSNIPER_OUTPUT_TTL,
+        "status": settings.CLIPSNIPER_OUTPUT_TTL,
+        "temp": settings.CLIPSNIPER_ORPHAN_AGE,
+        "temp_clips": settings.CLIPSNIPER_ORPHAN_AGE,
+        "uploads": settings.CLIPSNIPER_ORPHAN_AGE,
+    }
+
+class ExpiryIndex:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS expiry (path TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS expiry_expires_at ON expiry (expires_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, paths, expires_at):
+        self._connect().executemany(
+            "INSERT OR REPLACE INTO expiry (path, expires_at) VALUES (?, ?)",
+            [(os.path.abspath(p), expires_at) for p in paths])
+
+    def due(self, now, limit=1000):
+        return [row[0] for row in self._connect().execute(
+            "SELECT path FROM expiry WHERE expires_at <= ? ORDER BY expires_at LIMIT ?", (now, limit))]
+
+    def remove(self, paths):
+        self._connect().executemany("DELETE FROM expiry WHERE path = ?", [(p,) for p in paths])
+
+    def contains(self, path):
+        return self._connect().execute(
+            "SELECT 1 FROM expiry WHERE path = ?", (os.path.abspath(path),)).fetchone() is not None
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        print(f"[WARNING] Could not delete {path}: {e}")
+        return False
+
+def _files(directory):
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return []
+    return [entry for entry in entries if entry.is_file()]
+
+def reap(index, media_root, max_bytes, now=None, dry_run=False):
+    # One pass; returns (expired, orphaned, evicted) file counts.
+    now = time.time() if now is None else now
+    expired = 0
+    while True:
+        due = index.due(now)
+        if not due:
+            break
+        for path in due:
+            if not dry_run and _remove(path):
+                expired += 1
+            elif dry_run and os.path.exists(path):
+                expired += 1
+        if dry_run:
+            break
+        index.remove(due)
+
+    orphaned = 0
+    for name, max_age in managed_dirs().items():
+        for entry in _files(os.path.join(media_root, name)):
+            if now - entry.stat().st_mtime > max_age and not index.contains(entry.path):
+                if dry_run or _remove(entry.path):
+                    orphaned += 1
+
+    # Disk budget: oldest outputs go first until media/output fits.
+    outputs = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                     for entry in _files(os.path.join(media_root, "output")))
+    total = sum(size for _, size, _ in outputs)
+    evicted = []
+    for _, size, path in outputs:
+        if total <= max_bytes:
+            break
+        if dry_run or _remove(path):
+            evicted.append(path)
+        total -= size
+    if evicted and not dry_run:
+        index.remove([os.path.abspath(p) for p in evicted])
+    return expired, orphaned, len(evicted)
+
+_index = None
+_reaper_thread = None
+_reaper_lock = threading.Lock()
+
+def get_expiry_index():
+    global _index
+    if _index is None:
+        with _reaper_lock:
+            if _index is None:
+                _index = ExpiryIndex(settings.CLIPSNIPER_EXPIRY_DB)
+    return _index
+
+def run_reaper(interval):
+    while True:
+        try:
+            reap(get_expiry_index(), settings.MEDIA_ROOT, settings.CLIPSNIPER_MEDIA_MAX_BYTES)
+            from .status import get_status_store
+            get_status_store().purge_expired()
+        except Exception as e:
+            print(f"[ERROR] Media reaper pass failed: {e}")
+        time.sleep(interval)
+
+def start_reaper():
+    # Called from config/wsgi.py and config/asgi.py, which only serving
+    # processes load, and with the first job; not at import or in
+    # AppConfig.ready, so management commands and tests do not run it.
+    global _reaper_thread
+    if not settings.CLIPSNIPER_REAPER:
+        return
+    with _reaper_lock:
+        if _reaper_thread is None:
+            _reaper_thread = threading.Thread(
+                target=run_reaper, args=(settings.CLIPSNIPER_REAP_INTERVAL,), daemon=True)
+            _reaper_thread.start()
+
+def schedule_deletion(*paths, delay_seconds=None):
+    if delay_seconds is None:
+        delay_seconds = settings.CLIPSNIPER_OUTPUT_TTL
+    get_expiry_index().add(paths, time.time() + delay_seconds)
+    start_reaper()
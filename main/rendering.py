@@ -0,0 +1,35 @@
+import hashlib
+import markdown2
+from django.core.cache import cache
+
+# Blog posts are rendered once, when they are saved, and the HTML is stored
+# next to the Markdown with a hash of what it was rendered from. Bump
+# RENDER_VERSION whenever render_markdown changes so stored HTML is
+# re-rendered instead of served stale.
+RENDER_VERSION = 1
+CACHE_TIMEOUT = 24 * 3600
+
+def render_markdown(text):
+    # Same output the blog has always shown: markdown2 with no extras.
+    return markdown2.markdown(text)
+
+def content_hash(text):
+    return hashlib.sha256(f"{RENDER_VERSION}\0{text}".encode()).hexdigest()
+
+def cache_key(digest):
+    return f"blog_html:{digest}"
+
+def post_html(post):
+    # Cache first, then the stored rendering, and only render if the stored
+    # one is missing or was made from different content.
+    digest = content_hash(post.content)
+    key = cache_key(digest)
+    html = cache.get(key)
+    if html is not None:
+        return html
+    if post.content_hash == digest and post.content_html:
+        html = post.content_html
+    else:
+        html = render_markdown(post.content)
+    cache.set(key, html, CACHE_TIMEOUT)
+    return html
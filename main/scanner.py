@@ -0,0 +1,204 @@
+import math
+import multiprocessing
+import threading
+import cv2
+
+from .inference import load_model, match_frames, PRESETS, DEFAULT_MODE
+from .tracking import FaceTracker
+from .motion import MotionGate
+from .face_index import FaceIndexWriter
+from .timings import stage
+
+SHARDS_PER_WORKER = 4
+# Decoded frames scan_frames may hold (samples plus their gaps) before it
+# settles the window early, whatever batch_size asks for. A single gap
+# still needs stride - 1 frames, so the bound is max(this, stride + 1).
+MAX_BUFFERED_FRAMES = 64
+
+def read_frames(cap, start=0, end=None):
+    idx = start
+    while end is None or idx < end:
+        with stage("decode"):
+            ret, frame = cap.read()
+        if not ret:
+            break
+        yield idx, frame
+        idx += 1
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def stride_from_ms(stride_ms, fps):
+    return max(1, int(round(stride_ms * fps / 1000.0)))
+
+def scan_frames(frames, match_batch, stride=1, batch_size=1, on_frame=None, on_settled=None, gate=None):
+    # Run match_batch on every `stride`-th frame only, `batch_size` samples at
+    # a time. It receives (idx, frame) pairs and returns a set of matched
+    # labels per pair. Frames in between are kept in a buffer of at most
+    # MAX_BUFFERED_FRAMES (or one gap); when the label set changes between
+    # two samples the buffered gap is re-scanned densely so segment edges
+    # stay frame-accurate, and when both samples agree the gap inherits
+    # their labels without inference.
+    # on_settled(new_matches, last_idx) is called whenever every frame up to
+    # last_idx has a final answer. Matches are (idx, labels) pairs.
+    # gate: a MotionGate applied to the samples only; re-scanned gaps always
+    # run through match_batch so edges are never carried over from a sample.
+    matched = []
+    state = {"prev_hit": frozenset(), "inferred": 0, "reported": 0}
+
+    def infer(batch):
+        state["inferred"] += len(batch)
+        return match_batch(batch)
+
+    def settle(window):
+        samples = [(idx, frame) for idx, frame, _ in window]
+        hits = gate(samples, infer) if gate else infer(samples)
+        edges = []
+        for (idx, _, gap), hit in zip(window, hits):
+            if gap and hit != state["prev_hit"]:
+                edges.extend(gap)
+            elif gap and hit:
+                matched.extend((gap_idx, hit) for gap_idx, _ in gap)
+            if hit:
+                matched.append((idx, hit))
+            state["prev_hit"] = hit
+        for chunk in iter_batches(edges, batch_size):
+            hits = infer(chunk)
+            matched.extend((idx, hit) for (idx, _), hit in zip(chunk, hits) if hit)
+        if on_settled:
+            on_settled(sorted(matched[state["reported"]:], key=_frame_idx), window[-1][0])
+            state["reported"] = len(matched)
+
+    window = []
+    gap = []
+    buffered = 0
+    for idx, frame in frames:
+        if on_frame:
+            on_frame(idx)
+        buffered += 1
+        if idx % stride:
+            gap.append((idx, frame))
+            continue
+        window.append((idx, frame, gap))
+        gap = []
+        if len(window) >= batch_size or buffered >= MAX_BUFFERED_FRAMES:
+            settle(window)
+            window = []
+            buffered = 0
+    # The final frame counts as one more sample so a match that starts or
+    # ends in the tail after the last stride boundary is not lost.
+    if gap:
+        last_idx, last_frame = gap.pop()
+        window.append((last_idx, last_frame, gap))
+    if window:
+        settle(window)
+    matched.sort(key=_frame_idx)
+    return matched, state["inferred"]
+
+def _frame_idx(match):
+    return match[0]
+
+def frames_by_label(matched):
+    by_label = {}
+    for idx, labels in matched:
+        for label in labels:
+            by_label.setdefault(label, []).append(idx)
+    return by_label
+
+_worker_model = None
+_shard_pools = {}
+_shard_pools_lock = threading.Lock()
+
+def _init_shard_worker(model_root):
+    global _worker_model
+    cv2.setNumThreads(1)
+    _worker_model = load_model(model_root, threads=1)
+
+def _scan_shard(task):
+    video_path, start, end, gallery, stride, batch_size, track, motion_threshold, mode, index_root = task
+    preset = PRESETS[mode]
+    tracker = FaceTracker() if track else None
+    # Each shard writes its own part of the face index; the parent joins
+    # them in shard order.
+    writer = FaceIndexWriter(index_root, None, 0, 0, stride, frame_limit=end) if index_root else None
+    match_batch = lambda items: match_frames(
+        _worker_model, items, gallery, max_faces=preset["max_faces"], tracker=tracker,
+        on_faces=writer.add if writer else None,
+        det_size=preset["det_size"], max_height=preset["max_height"])
+    gate = MotionGate(motion_threshold, on_skip=writer.repeat if writer else None) if motion_threshold else None
+    cap = cv2.VideoCapture(video_path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    try:
+        matched, inferred = scan_shard_frames(
+            read_frames(cap, start, None if end is None else end + 1), match_batch, end,
+            stride=stride, batch_size=batch_size, gate=gate)
+    except BaseException:
+        if writer:
+            writer.discard()
+        raise
+    finally:
+        cap.release()
+    return matched, inferred, gate.skipped if gate else 0, writer.finish() if writer else None
+
+def scan_shard_frames(frames, match_batch, end, stride=1, batch_size=1, gate=None):
+    # `frames` runs from the shard's start through frame `end`: that frame
+    # is the next shard's first sample and closes this shard's trailing gap,
+    # so an edge that falls just before the boundary is still refined here.
+    # Its own result belongs to the next shard and is dropped.
+    matched, inferred = scan_frames(frames, match_batch, stride=stride, batch_size=batch_size, gate=gate)
+    if end is not None:
+        matched = [match for match in matched if match[0] < end]
+    return matched, inferred
+
+def get_shard_pool(workers, model_root):
+    # Pools are kept alive between jobs so each worker loads its model once.
+    # "spawn" gives every worker a clean onnxruntime instead of a forked copy
+    # of the parent's thread pools.
+    with _shard_pools_lock:
+        pool = _shard_pools.get(workers)
+        if pool is None:
+            ctx = multiprocessing.get_context("spawn")
+            pool = ctx.Pool(workers, initializer=_init_shard_worker, initargs=(model_root,))
+            _shard_pools[workers] = pool
+        return pool
+
+def shard_bounds(total_frames, shards, stride):
+    # Shard edges sit on stride boundaries so every shard starts on a sample
+    # and the union of shards samples exactly the frames a serial scan would.
+    shard_len = max(1, math.ceil(total_frames / max(1, shards) / stride)) * stride
+    return [(start, min(start + shard_len, total_frames)) for start in range(0, total_frames, shard_len)]
+
+def scan_video_sharded(video_path, total_frames, gallery, model_root, workers, stride=1, batch_size=1, track=False, motion_threshold=0, mode=DEFAULT_MODE, on_progress=None, on_settled=None, index_root=None):
+    # Returns (matched, inferred, gated, index parts); the parts are only
+    # written when index_root is given and go to face_index.merge_parts.
+    bounds = shard_bounds(total_frames, workers * SHARDS_PER_WORKER, stride) or [(0, None)]
+    # The last shard reads to the end of the file, since the container's
+    # frame count is only an estimate.
+    bounds[-1] = (bounds[-1][0], None)
+    tasks = [(video_path, start, end, gallery, stride, batch_size, track, motion_threshold, mode, index_root) for start, end in bounds]
+    pool = get_shard_pool(workers, model_root)
+    matched = []
+    inferred = 0
+    gated = 0
+    parts = []
+    # imap yields in submission order, so shard results concatenate sorted.
+    for done, (shard_matched, shard_inferred, shard_gated, part) in enumerate(pool.imap(_scan_shard, tasks), 1):
+        if part:
+            parts.append(part)
+        matched.extend(shard_matched)
+        inferred += shard_inferred
+        gated += shard_gated
+        if on_settled:
+            shard_end = bounds[done - 1][1]
+            on_settled(shard_matched, None if shard_end is None else shard_end - 1)
+        if on_progress:
+            on_progress(done, len(tasks))
+    return matched, inferred, gated, parts
@@ -0,0 +1,83 @@
+import re
+from datetime import datetime
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# Blog search runs against a full-text index instead of scanning every
+# post's content: an FTS5 table on SQLite, which BlogPost.save keeps in
+# step, and a generated tsvector column with a GIN index on Postgres, which
+# the database keeps in step itself. Both are created by migration 0004.
+# Results come back as a BlogPost queryset, so they page like the listing.
+FTS_TABLE = "main_blogpost_fts"
+TS_CONFIG = "english"
+
+def search_backend(vendor=None):
+    vendor = vendor or connection.vendor
+    return vendor if vendor in ("sqlite", "postgresql") else None
+
+def fts5_query(text):
+    # Every word must appear; the last one may be a prefix so results
+    # appear while typing. Words are quoted, so FTS5 operators typed by
+    # users are matched as text instead of parsed.
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+def index_post(post):
+    if search_backend() != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [post.pk])
+        cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)",
+                       [post.pk, post.title, post.content])
+
+def unindex_post(post_id):
+    if search_backend() != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [post_id])
+
+def search_posts(queryset, text):
+    backend = search_backend()
+    if backend == "sqlite":
+        query = fts5_query(text)
+        if query is None:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query]))
+    if backend == "postgresql":
+        # search_vector is a generated column the model does not know about,
+        # so it is queried in raw SQL like the FTS5 table.
+        table = queryset.model._meta.db_table
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT id FROM {table} WHERE search_vector @@ websearch_to_tsquery(%s, %s)", [TS_CONFIG, text]))
+    return queryset.filter(Q(title__icontains=text) | Q(content__icontains=text))
+
+# Keyset pagination: a page is "the next N posts older than (created_at,
+# id) of the last one shown", which the (created_at, id) index answers
+# directly however deep the reader goes, where OFFSET would walk past every
+# earlier post. The cursor is that pair, encoded into the URL.
+
+def encode_cursor(post):
+    return f"{post.created_at.isoformat()}_{post.pk}"
+
+def decode_cursor(cursor):
+    # (created_at, id), or None for a missing or malformed cursor.
+    try:
+        created_at, _, post_id = (cursor or "").rpartition("_")
+        return datetime.fromisoformat(created_at), int(post_id)
+    except ValueError:
+        return None
+
+def keyset_page(queryset, cursor, size):
+    # (posts, cursor of the next page or None), newest first.
+    queryset = queryset.order_by("-created_at", "-id")
+    after = decode_cursor(cursor)
+    if after:
+        created_at, post_id = after
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=post_id))
+    posts = list(queryset[:size + 1])
+    if len(posts) > size:
+        return posts[:size], encode_cursor(posts[size - 1])
+    return posts, None
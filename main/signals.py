@@ -0,0 +1,47 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .models import BlogPost, Project
+from .pagecache import bump_content_version
+from .search import unindex_post
+from .thumbnails import delete_derivatives, generate_derivatives
+
+# Thumbnail derivatives are made once here, not per request. A replaced or
+# deleted thumbnail takes its derivatives with it.
+@receiver(pre_save, sender=BlogPost)
+@receiver(pre_save, sender=Project)
+def remember_old_thumbnail(sender, instance, **kwargs):
+    old = sender.objects.filter(pk=instance.pk).values_list("thumbnail", flat=True).first() if instance.pk else None
+    instance._old_thumbnail = old
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_save, sender=Project)
+def update_thumbnail_derivatives(sender, instance, **kwargs):
+    old = getattr(instance, "_old_thumbnail", None)
+    if old and old != instance.thumbnail.name:
+        delete_derivatives(old)
+    if instance.thumbnail:
+        try:
+            generate_derivatives(instance.thumbnail.name)
+        except Exception as e:
+            print(f"[WARNING] Could not generate thumbnails for {instance.thumbnail.name}: {e}")
+
+@receiver(post_delete, sender=BlogPost)
+@receiver(post_delete, sender=Project)
+def delete_thumbnail_derivatives(sender, instance, **kwargs):
+    if instance.thumbnail:
+        delete_derivatives(instance.thumbnail.name)
+
+@receiver(post_delete, sender=BlogPost)
+def unindex_deleted_post(sender, instance, **kwargs):
+    unindex_post(instance.pk)
+
+# Receivers run in the order they are connected, so this one, connected
+# last, bumps the version once the derivatives exist; a page cached in
+# between would otherwise be served without its srcset until the next save.
+@receiver(post_save, sender=BlogPost)
+@receiver(post_delete, sender=BlogPost)
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_pages(sender, **kwargs):
+    bump_content_version()
@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from django.conf import settings
+
+# Job status lives in one store instead of a JSON file per job. Every store
+# has the same small API: get() is a single key lookup, update() merges
+# fields into a job's status atomically, and progress() drops writes that
+# come faster than min_interval so a scan does not hammer the backend.
+# Entries expire ttl seconds after their last write. Every write made
+# through a store is also handed to its listeners (see events.py), so
+# waiting clients are told about it without re-reading the backend.
+
+class StatusStore(ABC):
+    def __init__(self, ttl=3600, min_interval=1.0):
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self._last_progress = {}
+        self._progress_lock = threading.Lock()
+        self.listeners = []
+
+    def _notify(self, job_id, data):
+        for listener in self.listeners:
+            listener(job_id, data)
+
+    @abstractmethod
+    def get(self, job_id):
+        pass
+
+    @abstractmethod
+    def set(self, job_id, data, ttl=None):
+        pass
+
+    @abstractmethod
+    def update(self, job_id, ttl=None, **fields):
+        pass
+
+    @abstractmethod
+    def delete(self, job_id):
+        pass
+
+    @abstractmethod
+    def purge_expired(self):
+        # Returns how many expired entries were removed.
+        pass
+
+    def progress(self, job_id, percent, **fields):
+        # Returns True if the write went through. 100% is always written.
+        now = time.monotonic()
+        with self._progress_lock:
+            last = self._last_progress.get(job_id)
+            if last is not None and percent < 100 and now - last < self.min_interval:
+                return False
+            self._last_progress[job_id] = now
+        self.update(job_id, done=False, progress=int(percent), **fields)
+        return True
+
+    def finish(self, job_id, data, ttl=None):
+        # Final status replaces whatever progress was recorded.
+        with self._progress_lock:
+            self._last_progress.pop(job_id, None)
+        self.set(job_id, data, ttl)
+
+class MemoryStatusStore(StatusStore):
+    # Only visible to the process that writes it; fine for a single web
+    # process that also runs the jobs, and for tests.
+    def __init__(self, ttl=3600, min_interval=1.0):
+        super().__init__(ttl, min_interval)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.time():
+                del self._entries[job_id]
+                return None
+            return dict(data)
+
+    def set(self, job_id, data, ttl=None):
+        with self._lock:
+            self._entries[job_id] = (time.time() + (ttl or self.ttl), dict(data))
+        self._notify(job_id, dict(data))
+
+    def update(self, job_id, ttl=None, **fields):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            data = dict(entry[1]) if entry and entry[0] > time.time() else {}
+            data.update(fields)
+            self._entries[job_id] = (time.time() + (ttl or self.ttl), data)
+        self._notify(job_id, dict(data))
+        return dict(data)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for job_id in expired:
+                del self._entries[job_id]
+        return len(expired)
+
+class SQLiteStatusStore(StatusStore):
+    # One row per job in a WAL-mode database, so web and job processes on the
+    # same host share it and readers never wait on the writer.
+    def __init__(self, path, ttl=3600, min_interval=1.0):
+        super().__init__(ttl, min_interval)
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_status ("
+                "job_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS job_status_expires ON job_status (expires_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            "SELECT data FROM job_status WHERE job_id = ? AND expires_at > ?", (job_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, job_id, data, ttl=None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO job_status (job_id, data, expires_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(data), time.time() + (ttl or self.ttl)))
+        self._notify(job_id, dict(data))
+
+    def update(self, job_id, ttl=None, **fields):
+        conn = self._connect()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock before the read, so two
+        # writers cannot both merge into the same old value.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM job_status WHERE job_id = ? AND expires_at > ?", (job_id, now)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO job_status (job_id, data, expires_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(data), now + (ttl or self.ttl)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify(job_id, dict(data))
+        return data
+
+    def delete(self, job_id):
+        self._connect().execute("DELETE FROM job_status WHERE job_id = ?", (job_id,))
+
+    def purge_expired(self):
+        return self._connect().execute("DELETE FROM job_status WHERE expires_at <= ?", (time.time(),)).rowcount
+
+class RedisStatusStore(StatusStore):
+    # Shared by every host; expiry is Redis' own key TTL.
+    def __init__(self, url, ttl=3600, min_interval=1.0, prefix="clipsniper:status:"):
+        super().__init__(ttl, min_interval)
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, job_id):
+        return self.prefix + job_id
+
+    def get(self, job_id):
+        raw = self.redis.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    def set(self, job_id, data, ttl=None):
+        self.redis.set(self._key(job_id), json.dumps(data), ex=int(ttl or self.ttl))
+        self._notify(job_id, dict(data))
+
+    def update(self, job_id, ttl=None, **fields):
+        import redis
+        key = self._key(job_id)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    data = json.loads(raw) if raw else {}
+                    data.update(fields)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(data), ex=int(ttl or self.ttl))
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        self._notify(job_id, dict(data))
+        return data
+
+    def delete(self, job_id):
+        self.redis.delete(self._key(job_id))
+
+    def purge_expired(self):
+        return 0
+
+def build_status_store(backend, ttl=3600, min_interval=1.0, path=None, url=None):
+    if backend == "memory":
+        return MemoryStatusStore(ttl, min_interval)
+    if backend == "sqlite":
+        return SQLiteStatusStore(path, ttl, min_interval)
+    if backend == "redis":
+        return RedisStatusStore(url, ttl, min_interval)
+    raise ValueError(f"Unknown status backend: {backend}")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_status_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = build_status_store(
+                    settings.CLIPSNIPER_STATUS_BACKEND,
+                    ttl=settings.CLIPSNIPER_STATUS_TTL,
+                    min_interval=settings.CLIPSNIPER_STATUS_MIN_INTERVAL,
+                    path=settings.CLIPSNIPER_STATUS_PATH,
+                    url=settings.CLIPSNIPER_REDIS_URL,
+                )
+                from .events import broker
+                _store.listeners.append(broker.publish)
+    return _store
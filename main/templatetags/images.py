@@ -0,0 +1,30 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from ..thumbnails import available_derivatives, fallback_ext
+
+register = template.Library()
+
+@register.simple_tag
+def responsive_image(image, alt="", sizes="100vw", **attrs):
+    # <picture> with a WebP srcset and a fallback srcset built from the
+    # derivatives made by thumbnails.generate_derivatives; the original file
+    # when there are none yet.
+    if not image:
+        return ""
+    extra = format_html_join("", ' {}="{}"', ((key.replace("_", "-"), value) for key, value in attrs.items()))
+    variants = available_derivatives(image.name)
+    fallback = variants.get(fallback_ext(image.name))
+    if not fallback:
+        return format_html('<img src="{}" alt="{}" loading="lazy"{}>', image.url, alt, extra)
+    webp = variants.get("webp")
+    webp_source = ""
+    if webp:
+        webp_source = format_html('<source type="image/webp" srcset="{}" sizes="{}">', _srcset(webp), sizes)
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy"{}></picture>',
+        webp_source, fallback[-1][1], _srcset(fallback), sizes, alt, extra)
+
+def _srcset(variants):
+    return mark_safe(", ".join(f"{url} {width}w" for width, url in variants))
@@ -1,9 +1,10 @@
-import markdown2
 from django import template
 from django.utils.safestring import mark_safe
 
+from ..rendering import render_markdown
+
 register = template.Library()
 
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown2.markdown(text))
+    return mark_safe(render_markdown(text))
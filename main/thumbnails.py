@@ -0,0 +1,88 @@
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Thumbnails are resized once, when their model is saved, into a few widths,
+# each as WebP plus a JPEG (PNG for images with transparency) fallback.
+# Names are derived from the source name alone, e.g.
+# blog_thumbs/cat.png -> derivatives/blog_thumbs/cat.png-640w.webp, so templates
+# can find them without a lookup table. The source extension stays in the
+# name so cat.jpg and cat.png do not share derivatives.
+WIDTHS = (320, 640, 960)
+DERIVATIVE_DIR = "derivatives"
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+def derivative_name(source_name, width, ext):
+    return f"{DERIVATIVE_DIR}/{source_name}-{width}w.{ext}"
+
+def fallback_ext(source_name):
+    return "png" if os.path.splitext(source_name)[1].lower() in (".png", ".gif", ".webp") else "jpg"
+
+def _encode(image, ext):
+    buf = BytesIO()
+    if ext == "webp":
+        image.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+    elif ext == "png":
+        image.save(buf, "PNG", optimize=True)
+    else:
+        image.convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+def generate_derivatives(source_name, force=False):
+    # Returns the names written. Widths at or above the source width are
+    # replaced by one copy at the source width, so images are never
+    # upscaled and a small image still gets a WebP version. An image that
+    # already has derivatives is not decoded again unless forced.
+    from PIL import Image, ImageOps
+
+    if not force and _derivative_files(source_name):
+        return []
+
+    with default_storage.open(source_name, "rb") as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+    widths = sorted({w for w in WIDTHS if w < image.width} | {min(image.width, WIDTHS[-1])})
+    written = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for ext in ("webp", fallback_ext(source_name)):
+            name = derivative_name(source_name, width, ext)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(_encode(resized, ext)))
+            written.append(name)
+    return written
+
+def _derivative_files(source_name):
+    # [(width, ext, name)] of the derivatives on disk, from one listdir.
+    directory, base = os.path.split(derivative_name(source_name, 0, "webp"))
+    prefix = base[:-len("0w.webp")]
+    try:
+        _, files = default_storage.listdir(directory)
+    except (FileNotFoundError, NotImplementedError):
+        return []
+    found = []
+    for name in files:
+        if not name.startswith(prefix):
+            continue
+        width, sep, ext = name[len(prefix):].partition("w.")
+        if sep and width.isdigit():
+            found.append((int(width), ext, f"{directory}/{name}"))
+    return found
+
+def available_derivatives(source_name):
+    # {ext: [(width, url)]} for the derivatives that exist, smallest first.
+    found = {}
+    for width, ext, name in sorted(_derivative_files(source_name)):
+        found.setdefault(ext, []).append((width, default_storage.url(name)))
+    return found
+
+def delete_derivatives(source_name):
+    for _, _, name in _derivative_files(source_name):
+        default_storage.delete(name)
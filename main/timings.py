@@ -0,0 +1,51 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import STAGE_SECONDS
+
+# Busy time per pipeline stage. Stages overlap (decoding runs on its own
+# thread, segments are encoded while the scan goes on), so the stage times
+# of a job add up to more than its wall time. Every call feeds the
+# clipsniper_stage_seconds histogram; the per-run totals are only kept while
+# a recorder is active (the benchmark sets one).
+STAGES = ("decode", "detect", "embed", "match", "group", "encode")
+
+class StageTimings:
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {name: {"seconds": round(self.seconds[name], 6), "calls": self.calls[name]} for name in self.seconds}
+
+_active = None
+
+def start_recording():
+    global _active
+    _active = StageTimings()
+    return _active
+
+def stop_recording():
+    global _active
+    timings, _active = _active, None
+    return timings
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _active
+        if timings is not None:
+            timings.add(name, elapsed)
@@ -0,0 +1,82 @@
+import numpy as np
+
+def box_iou(a, b):
+    # Pairwise IoU of (n, 4) and (m, 4) x1, y1, x2, y2 boxes.
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+class Track:
+    def __init__(self, box, idx):
+        self.box = box
+        self.last_seen = idx
+        self.iou = 1.0
+        self.labels = frozenset()
+        self.embedding = None
+        self.verified_at = None
+        self.pending = None
+
+class FaceTracker:
+    # Greedy IoU association of detections across frames. A track keeps the
+    # labels and embedding of its last verification so later frames of the
+    # same face can skip the recognition model; it is re-embedded every
+    # `reverify_every` frames or when the box jumped enough that the overlap
+    # with the previous one drops below `confident_iou`.
+    def __init__(self, min_iou=0.3, confident_iou=0.5, reverify_every=30, max_gap=15):
+        self.min_iou = min_iou
+        self.confident_iou = confident_iou
+        self.reverify_every = reverify_every
+        self.max_gap = max_gap
+        self.tracks = []
+        self.embedded = 0
+        self.reused = 0
+
+    def update(self, idx, faces):
+        # Frames can arrive out of order (edge refinement goes back in time),
+        # so staleness is measured as a distance in frame numbers.
+        self.tracks = [t for t in self.tracks if abs(idx - t.last_seen) <= self.max_gap]
+        assigned = [None] * len(faces)
+        if faces and self.tracks:
+            ious = box_iou([f.bbox for f in faces], [t.box for t in self.tracks])
+            while True:
+                i, j = np.unravel_index(np.argmax(ious), ious.shape)
+                if ious[i, j] < self.min_iou:
+                    break
+                assigned[i] = self.tracks[j]
+                assigned[i].iou = float(ious[i, j])
+                ious[i, :] = -1
+                ious[:, j] = -1
+        for i, face in enumerate(faces):
+            if assigned[i] is None:
+                assigned[i] = Track(face.bbox, idx)
+                self.tracks.append(assigned[i])
+            assigned[i].box = face.bbox
+            assigned[i].last_seen = idx
+        return assigned
+
+    def needs_embedding(self, track, idx):
+        # A track already waiting for an embedding in this batch inherits it.
+        if track.pending is not None:
+            fresh = True
+        elif track.verified_at is None:
+            fresh = False
+        else:
+            fresh = abs(idx - track.verified_at) < self.reverify_every and track.iou >= self.confident_iou
+        if fresh:
+            self.reused += 1
+        else:
+            self.embedded += 1
+        return not fresh
+
+    def verified(self, track, idx, embedding, labels):
+        track.embedding = embedding
+        track.labels = labels
+        track.verified_at = idx
+        track.pending = None
@@ -0,0 +1,321 @@
+import json
+import os
+import struct
+import subprocess
+import threading
+import time
+import uuid
+import numpy as np
+from django.conf import settings
+
+from .timings import stage
+
+# Resumable uploads: a client creates an upload with its total size, then
+# appends chunks at the offset the server reports. The bytes go straight to
+# media/uploads/<id>.part, so no request holds more than one chunk, and a
+# client that lost its connection asks for the offset and carries on.
+# A job submitted for an upload that cannot be read yet is parked next to it
+# (<id>.job) and queued by whichever chunk makes it readable, so no job
+# worker sits waiting on a slow client. An upload feeds one job only
+# (<id>.owner, see claim_upload).
+
+CHUNK_COPY_SIZE = 1024 * 1024
+# Clients are told to send CHUNK_SIZE; anything over MAX_CHUNK_SIZE is refused.
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# How long a job waits on an upload that stopped receiving data.
+STALL_TIMEOUT = 300
+POLL_INTERVAL = 0.2
+
+class UploadError(Exception):
+    pass
+
+class UploadLimit(UploadError):
+    pass
+
+class UploadInUse(UploadError):
+    pass
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+_append_lock = threading.Lock()
+_create_lock = threading.Lock()
+
+def upload_dir():
+    return os.path.join(settings.MEDIA_ROOT, "uploads")
+
+def upload_path(upload_id):
+    return os.path.join(upload_dir(), f"{upload_id}.part")
+
+def _meta_path(upload_id):
+    return os.path.join(upload_dir(), f"{upload_id}.json")
+
+def _job_path(upload_id):
+    return os.path.join(upload_dir(), f"{upload_id}.job")
+
+def _owner_path(upload_id):
+    return os.path.join(upload_dir(), f"{upload_id}.owner")
+
+def active_uploads():
+    # [(upload_id, meta)] of unfinished uploads that received data within
+    # STALL_TIMEOUT; abandoned ones stop counting against the limits.
+    try:
+        names = os.listdir(upload_dir())
+    except FileNotFoundError:
+        return []
+    now = time.time()
+    active = []
+    for name in names:
+        upload_id, ext = os.path.splitext(name)
+        if ext != ".part":
+            continue
+        try:
+            stat = os.stat(os.path.join(upload_dir(), name))
+        except OSError:
+            continue
+        meta = upload_meta(upload_id)
+        if meta is not None and stat.st_size < meta["size"] and now - stat.st_mtime < STALL_TIMEOUT:
+            active.append((upload_id, meta))
+    return active
+
+def create_upload(size, filename="", client="", max_per_client=None, max_active_bytes=None):
+    # Raises UploadLimit when `client` already has max_per_client uploads in
+    # progress, or when all uploads in progress would reserve more than
+    # max_active_bytes.
+    with _create_lock:
+        active = [meta for _, meta in active_uploads()]
+        if max_per_client is not None and sum(1 for meta in active if meta.get("client") == client) >= max_per_client:
+            raise UploadLimit("Too many uploads in progress from this client.")
+        if max_active_bytes is not None and sum(meta["size"] for meta in active) + size > max_active_bytes:
+            raise UploadLimit("Too many uploads in progress.")
+        upload_id = uuid.uuid4().hex
+        os.makedirs(upload_dir(), exist_ok=True)
+        open(upload_path(upload_id), "wb").close()
+        with open(_meta_path(upload_id), "w") as f:
+            json.dump({"size": size, "filename": filename, "client": client, "created": time.time()}, f)
+    return upload_id
+
+def upload_meta(upload_id):
+    # None for unknown ids; ids are hex so they cannot escape upload_dir().
+    if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+        return None
+    try:
+        with open(_meta_path(upload_id)) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def upload_offset(upload_id):
+    try:
+        return os.path.getsize(upload_path(upload_id))
+    except OSError:
+        return 0
+
+def is_complete(upload_id):
+    meta = upload_meta(upload_id)
+    return meta is not None and upload_offset(upload_id) >= meta["size"]
+
+def append_chunk(upload_id, offset, stream, length):
+    # Appends `length` bytes read from `stream` if `offset` is where the
+    # upload currently ends; returns the new offset.
+    meta = upload_meta(upload_id)
+    if meta is None:
+        raise UploadError("Unknown upload.")
+    with _append_lock:
+        current = upload_offset(upload_id)
+        if offset != current:
+            raise OffsetMismatch(current)
+        if current + length > meta["size"]:
+            raise UploadError("Chunk runs past the declared size.")
+        written = 0
+        with open(upload_path(upload_id), "ab") as f:
+            while written < length:
+                data = stream.read(min(CHUNK_COPY_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        # The reaper treats untouched files in uploads/ as orphaned, so the
+        # metadata and any parked job age with the upload, not its creation.
+        for path in (_meta_path(upload_id), _job_path(upload_id), _owner_path(upload_id)):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return current + written
+
+def delete_upload(upload_id):
+    for path in (upload_path(upload_id), _meta_path(upload_id), _job_path(upload_id), _owner_path(upload_id)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def upload_ready(upload_id):
+    # True once a job can read the upload: it is complete, or it is a
+    # faststart MP4 whose header has arrived and can be scanned as it grows.
+    return is_complete(upload_id) or mp4_header_ready(upload_path(upload_id)) is True
+
+def claim_upload(upload_id, job_id):
+    # One job per upload: a second one would scan the same file and delete
+    # it under the first. Raises UploadInUse if the upload already has one;
+    # the claim goes with the upload (delete_upload) or release_upload.
+    try:
+        fd = os.open(_owner_path(upload_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        raise UploadInUse("This upload already has a job.")
+    with os.fdopen(fd, "w") as f:
+        f.write(job_id)
+
+def release_upload(upload_id):
+    try:
+        os.remove(_owner_path(upload_id))
+    except OSError:
+        pass
+
+def park_job(upload_id, job):
+    # job: a JSON-serialisable description of the job to queue once the
+    # upload is ready (see take_parked_job). The link fails instead of
+    # replacing a job already parked on the upload.
+    tmp_path = f"{_job_path(upload_id)}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    try:
+        os.link(tmp_path, _job_path(upload_id))
+    except FileExistsError:
+        raise UploadInUse("This upload already has a job.")
+    finally:
+        os.remove(tmp_path)
+
+def take_parked_job(upload_id):
+    # The parked job if the upload has become ready, handed to exactly one
+    # caller: the rename fails for everyone after the first.
+    if not os.path.exists(_job_path(upload_id)) or not upload_ready(upload_id):
+        return None
+    taken_path = f"{_job_path(upload_id)}.{uuid.uuid4().hex}.taken"
+    try:
+        os.rename(_job_path(upload_id), taken_path)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(taken_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(taken_path)
+
+def mp4_header_ready(path):
+    # True once an MP4/MOV's moov box (the index of every sample) has fully
+    # arrived ahead of the media data, False if the media data comes first
+    # (the file can only be read once complete), None if it is too early to
+    # tell.
+    try:
+        size = os.path.getsize(path)
+        f = open(path, "rb")
+    except OSError:
+        return None
+    with f:
+        pos = 0
+        while pos + 8 <= size:
+            f.seek(pos)
+            box_size, box_type = struct.unpack(">I4s", f.read(8))
+            if box_size == 1:
+                if pos + 16 > size:
+                    return None
+                box_size = struct.unpack(">Q", f.read(8))[0]
+            elif box_size == 0:
+                box_size = size - pos
+            if box_size < 8:
+                return False
+            if box_type == b"moov":
+                return pos + box_size <= size or None
+            if box_type == b"mdat":
+                return False
+            pos += box_size
+        return None
+
+def wait_for_upload(upload_id, ready):
+    # Blocks until ready() is true, raising UploadError when the upload has
+    # been removed or has not grown for STALL_TIMEOUT seconds.
+    last_offset = -1
+    last_change = time.monotonic()
+    while not ready():
+        if upload_meta(upload_id) is None:
+            raise UploadError("Upload was removed.")
+        offset = upload_offset(upload_id)
+        if offset != last_offset:
+            last_offset, last_change = offset, time.monotonic()
+        elif time.monotonic() - last_change > STALL_TIMEOUT:
+            raise UploadError("Upload stalled.")
+        time.sleep(POLL_INTERVAL)
+
+def _follow(upload_id, sink, stop):
+    # Copies the upload into `sink` as it grows, until all of it is written
+    # or `stop` is set.
+    total = upload_meta(upload_id)["size"]
+    sent = 0
+    with open(upload_path(upload_id), "rb") as f:
+        while sent < total and not stop.is_set():
+            data = f.read(CHUNK_COPY_SIZE)
+            if data:
+                sink.write(data)
+                sent += len(data)
+                continue
+            wait_for_upload(upload_id, lambda: stop.is_set() or upload_offset(upload_id) > sent)
+
+def _read_exactly(stream, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    filled = 0
+    while filled < size:
+        n = stream.readinto(view[filled:])
+        if not n:
+            return None
+        filled += n
+    return buf
+
+def read_growing_frames(upload_id, width, height):
+    # Same (idx, frame) stream as read_frames, for an upload that is still
+    # arriving: a feeder thread pipes the bytes into ffmpeg as they land and
+    # ffmpeg decodes to raw BGR frames.
+    proc = subprocess.Popen([
+        "ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+        "-an", "-f", "rawvideo", "-pix_fmt", "bgr24", "-fps_mode", "passthrough", "pipe:1",
+    ], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+    stop = threading.Event()
+
+    def feed():
+        try:
+            _follow(upload_id, proc.stdin, stop)
+        except (OSError, UploadError) as e:
+            errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    frame_size = width * height * 3
+    idx = 0
+    try:
+        while True:
+            with stage("decode"):
+                data = _read_exactly(proc.stdout, frame_size)
+            if data is None:
+                break
+            yield idx, np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+            idx += 1
+    finally:
+        stop.set()
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        feeder.join()
+    if errors and not isinstance(errors[0], BrokenPipeError):
+        raise errors[0]
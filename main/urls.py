@@ -9,5 +9,8 @@ urlpatterns = [
     path('projects/<slug:slug>/demo/', views.project_demo, name='project_demo'),
     path('projects/', views.project_list, name='project_list'),
     path('clipsniper_demo/', views.clipsniper_demo, name='clipsniper_demo'),
-    path('check_status', views.check_status, name='check_status')
+    path('check_status', views.check_status, name='check_status'),
+    path('metrics', views.metrics, name='metrics'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<str:upload_id>/', views.upload_chunk, name='upload_chunk'),
 ]
@@ -0,0 +1,123 @@
+import bisect
+import os
+import subprocess
+
+TARGET_HEIGHT = 360
+# Above this many segments the per-segment inputs are swapped for trim
+# filters on a single input, so ffmpeg does not open hundreds of decoders.
+MAX_SEEK_INPUTS = 32
+
+def probe_keyframes(video_path):
+    # Packet flags are read from the container index, so this does not decode.
+    result = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0",
+        video_path
+    ], check=True, capture_output=True, text=True)
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    keyframes.sort()
+    return keyframes
+
+def _near_keyframe(t, keyframes, tolerance):
+    i = bisect.bisect_left(keyframes, t - tolerance)
+    return i < len(keyframes) and keyframes[i] <= t + tolerance
+
+def can_stream_copy(segments, keyframes, source_height, fps, duration=None, target_height=TARGET_HEIGHT):
+    # A copy is only exact when no downscale is needed and every segment
+    # starts on a keyframe and ends on one (or at the end of the video).
+    if not keyframes or not source_height or source_height > target_height:
+        return False
+    tolerance = 0.5 / fps
+    for start, end in segments:
+        if not _near_keyframe(start, keyframes, tolerance):
+            return False
+        if not (_near_keyframe(end, keyframes, tolerance) or (duration and end >= duration - tolerance)):
+            return False
+    return True
+
+def _copy_segments(video_path, segments, output_path):
+    list_path = output_path + ".txt"
+    source = os.path.abspath(video_path)
+    with open(list_path, "w") as f:
+        for start, end in segments:
+            f.write(f"file '{source}'\ninpoint {start:.6f}\noutpoint {end:.6f}\n")
+    try:
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-an", "-c", "copy", "-movflags", "+faststart",
+            output_path
+        ], check=True)
+    finally:
+        os.remove(list_path)
+
+def _encode_segments(video_path, segments, output_path, target_height=TARGET_HEIGHT):
+    inputs = []
+    chains = []
+    if len(segments) <= MAX_SEEK_INPUTS:
+        # One input per segment with input-side seeking: only the matched
+        # ranges are decoded.
+        for i, (start, end) in enumerate(segments):
+            inputs += ["-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", video_path]
+            chains.append(f"[{i}:v]setpts=PTS-STARTPTS[v{i}]")
+    else:
+        inputs = ["-i", video_path]
+        for i, (start, end) in enumerate(segments):
+            chains.append(f"[0:v]trim=start={start:.6f}:end={end:.6f},setpts=PTS-STARTPTS[v{i}]")
+    labels = "".join(f"[v{i}]" for i in range(len(segments)))
+    graph = ";".join(chains + [f"{labels}concat=n={len(segments)}:v=1:a=0,scale=-2:{target_height}[out]"])
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", *inputs,
+        "-filter_complex", graph, "-map", "[out]",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        output_path
+    ], check=True)
+
+def extract_segments(video_path, segments, output_path, fps, source_height=None, duration=None, target_height=TARGET_HEIGHT):
+    # Cut and join every matched segment in a single ffmpeg run: a stream
+    # copy when the edges line up with keyframes, otherwise one filter graph
+    # that decodes the matched ranges and encodes the result once.
+    if not segments:
+        return None
+    try:
+        keyframes = probe_keyframes(video_path)
+    except (OSError, subprocess.CalledProcessError):
+        keyframes = []
+    if can_stream_copy(segments, keyframes, source_height, fps, duration, target_height):
+        _copy_segments(video_path, segments, output_path)
+    else:
+        _encode_segments(video_path, segments, output_path, target_height)
+    return output_path
+
+def cut_segment(video_path, start, end, output_path, target_height=TARGET_HEIGHT):
+    # Input-side -ss seeks to the nearest keyframe and decodes forward, so the
+    # cut is frame-accurate while only the segment itself is encoded.
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-ss", f"{start:.6f}", "-i", video_path, "-t", f"{end - start:.6f}",
+        "-an", "-vf", f"scale=-2:{target_height}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        output_path
+    ], check=True)
+
+def concat_parts(part_paths, output_path):
+    # Parts share codec settings, so the concat demuxer can join them with a
+    # stream copy instead of another encode.
+    list_path = output_path + ".txt"
+    with open(list_path, "w") as f:
+        for part in part_paths:
+            f.write(f"file '{os.path.abspath(part)}'\n")
+    try:
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", "-movflags", "+faststart",
+            output_path
+        ], check=True)
+    finally:
+        os.remove(list_path)
@@ -1,26 +1,50 @@
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from .models import BlogPost, Project
-import markdown2
 from django.core.files.storage import default_storage
 from django.conf import settings
+from django.utils.text import slugify
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from asgiref.sync import sync_to_async
 import os
-import numpy as np
+import asyncio
 import cv2
 import uuid
-import json
-import threading
 import gc
 import time
-import subprocess
-from moviepy.editor import VideoFileClip, concatenate_videoclips
-from insightface.app import FaceAnalysis
+from .scanner import read_frames, scan_frames, scan_video_sharded, stride_from_ms, frames_by_label
+from .pipeline import threaded_frames, StreamingSegments, SegmentWriter
+from .video import extract_segments
+from .face_index import file_sha256, load_index, FaceIndexWriter, merge_parts, enforce_budget, INDEX_VERSION
+from .tracking import FaceTracker
+from .motion import MotionGate
+from .timings import stage
+from .metrics import FRAMES_INFERRED, INFERENCE_FPS, render_metrics
+from .profiler import profile_job
+from .status import get_status_store
+from .uploads import (
+    create_upload, upload_meta, upload_path, upload_offset, is_complete, append_chunk, delete_upload,
+    wait_for_upload, mp4_header_ready, read_growing_frames, upload_ready, park_job, take_parked_job,
+    claim_upload, release_upload, UploadError, UploadLimit, UploadInUse, OffsetMismatch, CHUNK_SIZE, MAX_CHUNK_SIZE,
+)
+from .reaper import schedule_deletion
+from .rendering import post_html
+from .pagecache import cached_page
+from .search import search_posts, keyset_page
+from .jobs import hash_upload, job_key, claim, store_result, release, scheduler, QueueFull, job_status
+from .inference import get_model, match_frames, Gallery, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE, PRESETS, DEFAULT_MODE
 
 model_root = os.path.join("models")
-model = FaceAnalysis(name='buffalo_sc', root=model_root)
-model.prepare(ctx_id=-1)
 MAX_UPLOAD_SIZE = 25 * 1024 * 1024
+# Every frame unless the client asks for a stride, so results only change
+# for clients that opt in.
+DEFAULT_SCAN_STRIDE = 1
+MAX_SCAN_STRIDE = 60
+MAX_PEOPLE = 5
+MAX_REFERENCE_IMAGES = 5
+BLOG_PAGE_SIZE = 12
 
+@cached_page
 def home_view(request):
     latest_posts = BlogPost.objects.order_by('-created_at')[:3]
     top_projects = Project.objects.all()[:3]
@@ -30,22 +54,34 @@ def home_view(request):
     }
     return render(request, 'home.html', context)
 
+@cached_page
 def blog_detail(request, slug):
     post = get_object_or_404(BlogPost, slug=slug)
-    content_html = markdown2.markdown(post.content, extras=["fenced-code-blocks", "tables", "break-on-newline"])
+    content_html = post_html(post)
     return render(request, 'blog_detail.html', {'post': post, 'content_html': content_html})
 
+@cached_page
 def blog_list(request):
-    posts = BlogPost.objects.order_by("-created_at")[:3]
-    return render(request, "blog_list.html", {"posts": posts})
+    query = request.GET.get("q", "").strip()[:200]
+    posts = BlogPost.objects.defer("content", "content_html")
+    if query:
+        posts = search_posts(posts, query)
+    posts, next_cursor = keyset_page(posts, request.GET.get("after"), BLOG_PAGE_SIZE)
+    return render(request, "blog_list.html", {
+        "posts": posts, "query": query, "next_cursor": next_cursor, "paged": bool(request.GET.get("after")),
+    })
 
+@cached_page
 def project_detail(request, slug):
     project = get_object_or_404(Project, slug=slug)
     return render(request, 'project_detail.html', {'project': project})
 
 def project_demo(request, slug):
-    return render(request, 'project_demo.html', {'project_slug': slug})
+    return render(request, 'project_demo.html', {
+        'project_slug': slug, 'max_video_size': settings.CLIPSNIPER_MAX_CHUNKED_UPLOAD_SIZE,
+    })
 
+@cached_page
 def project_list(request):
     projects = Project.objects.all()
     return render(request, 'project_list.html', {'projects': projects})
@@ -59,9 +95,6 @@ def extract_embeddings(img_path, model):
         raise ValueError("No face found in reference image.")
     return faces[0].embedding
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
 def group_timestamps(timestamps, fps, max_gap=0.5):
     if not timestamps:
         return []
@@ -76,150 +109,496 @@ def group_timestamps(timestamps, fps, max_gap=0.5):
     segments.append((start, prev + 1/fps))
     return segments
 
-def process_video_job(job_id, video_path, image_path):
-    status_path = os.path.join(settings.MEDIA_ROOT, "status", f"{job_id}.json")
-    os.makedirs(os.path.dirname(status_path), exist_ok=True)
+def build_gallery(references):
+    people = []
+    for label, image_paths, threshold in references:
+        embeddings = []
+        for image_path in image_paths:
+            try:
+                embeddings.append(extract_embeddings(image_path, get_model(model_root)))
+            except ValueError as e:
+                raise ValueError(f"{label}: {e}")
+        people.append((label, embeddings, threshold))
+    return Gallery(people)
+
+def output_filename(job_id, label, multi):
+    return f"{job_id}_{label}.mp4" if multi else f"{job_id}.mp4"
+
+def save_face_index(job_id, save):
+    # The index only speeds up later queries of the same video, so a failure
+    # to write it (a full disk, a concurrent job replacing the same digest)
+    # is logged and the job goes on.
     try:
-        ref_embedding = extract_embeddings(image_path, model)
+        save()
+    except OSError as e:
+        print(f"[WARNING] Job {job_id}: could not save the face index: {e}")
+
+def process_video_job(job_id, video_path, references, profile=False, **options):
+    # profile: sample the job's stacks into CLIPSNIPER_PROFILE_DIR.
+    with profile_job(job_id, profile):
+        run_video_job(job_id, video_path, references, **options)
+
+def run_video_job(job_id, video_path, references, stride=DEFAULT_SCAN_STRIDE, stride_ms=None, batch_size=DEFAULT_BATCH_SIZE, workers=None, video_digest=None, cache_key=None, motion_threshold=None, mode=DEFAULT_MODE, upload_id=None):
+    # references: [(label, [image paths], threshold)], one entry per person.
+    # upload_id: the chunked upload video_path belongs to, possibly still
+    # arriving.
+    status = get_status_store()
+    started = time.perf_counter()
+    writers = {}
+    index_writer = None
+    try:
+        gallery = build_gallery(references)
+        multi = len(gallery.labels) > 1
+        growing = False
+        if upload_id and not is_complete(upload_id):
+            # A faststart MP4 can be scanned as soon as its moov box is in;
+            # anything else is only readable once the upload completes.
+            wait_for_upload(upload_id, lambda: is_complete(upload_id) or mp4_header_ready(video_path) is not None)
+            growing = not is_complete(upload_id) and bool(mp4_header_ready(video_path))
+            if not growing:
+                wait_for_upload(upload_id, lambda: is_complete(upload_id))
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
+        if growing and not fps:
+            cap.release()
+            growing = False
+            wait_for_upload(upload_id, lambda: is_complete(upload_id))
+            cap = cv2.VideoCapture(video_path)
+            fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        match_timestamps = []
-        for idx in range(total_frames):
-            ret, frame = cap.read()
-            if not ret:
-                break
-            faces = model.get(frame)
-            for f in faces[:3]:
-                sim = cosine_similarity(ref_embedding, f.embedding)
-                if sim > 0.45:
-                    timestamp = idx / fps
-                    match_timestamps.append(timestamp)
-                    break
-            if idx % 10 == 0:
-                atomic_write_json({"done": False, "progress": int((idx/total_frames)*100)}, status_path)
-        cap.release()
-        segments = group_timestamps(match_timestamps, fps)
-        segments = [(s, e) for s, e in segments if e - s > 0.1]
-        if not segments:
-            print("[WARNING] No matching segments found.")
-            atomic_write_json({"done": False, "output_url": None, "message": "No matching clips found"}, status_path)
-            return
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if stride_ms:
+            stride = stride_from_ms(stride_ms, fps)
+        stride = max(1, min(int(stride), MAX_SCAN_STRIDE))
+        if workers is None:
+            workers = settings.CLIPSNIPER_SCAN_WORKERS
+        if motion_threshold is None:
+            motion_threshold = settings.CLIPSNIPER_MOTION_THRESHOLD
+        frames_gated = 0
+        preset = PRESETS[mode]
+        output_dir = os.path.join(settings.MEDIA_ROOT, "output")
+        os.makedirs(output_dir, exist_ok=True)
+        index_root = settings.CLIPSNIPER_FACE_INDEX_ROOT
+        # What the index holds depends on the detector settings, so each
+        # preset keeps its own index of a video. A video that is still
+        # arriving cannot be hashed yet: it is indexed once the scan is done.
+        digest = None
+        if settings.CLIPSNIPER_FACE_INDEX and not growing:
+            digest = f"{video_digest or file_sha256(video_path)}-{mode}"
+        index = load_index(index_root, digest, stride) if digest else None
+        outputs = {}
+        if index is not None or (workers > 1 and not growing):
+            cap.release()
+            if index is not None:
+                # Same video seen before: answer from the stored faces without
+                # decoding or running the model.
+                by_label = index.match(gallery, max_faces=preset["max_faces"])
+                frames_inferred = 0
+            else:
+                # Shards already keep every core busy, so the output is cut in
+                # one ffmpeg run once all matches are known.
+                def report_shards(done, total):
+                    status.progress(job_id, int((done/total)*100))
+                matched, frames_inferred, frames_gated, parts = scan_video_sharded(
+                    video_path, total_frames, gallery, model_root,
+                    workers=workers, stride=stride, batch_size=batch_size,
+                    track=settings.CLIPSNIPER_FACE_TRACKER, motion_threshold=motion_threshold,
+                    mode=mode, on_progress=report_shards, index_root=index_root if digest else None,
+                )
+                by_label = frames_by_label(matched)
+                if parts:
+                    def save():
+                        merge_parts(index_root, digest, parts, {
+                            "version": INDEX_VERSION, "fps": fps, "total_frames": total_frames, "stride": stride,
+                        })
+                        enforce_budget(index_root, settings.CLIPSNIPER_FACE_INDEX_MAX_BYTES)
+                    save_face_index(job_id, save)
+            for label in gallery.labels:
+                with stage("group"):
+                    segments = group_timestamps([idx / fps for idx in by_label.get(label, [])], fps)
+                    segments = [(s, e) for s, e in segments if e - s > 0.1]
+                with stage("encode"):
+                    output_path = extract_segments(
+                        video_path, segments, os.path.join(output_dir, output_filename(job_id, label, multi)), fps,
+                        source_height=height, duration=total_frames / fps if fps else None,
+                    )
+                outputs[label] = (segments, output_path)
+        else:
+            # Segments are cut as soon as the scan has moved far enough past
+            # them that they cannot grow, so encoding overlaps with scanning.
+            groupers = {}
+            for label in gallery.labels:
+                groupers[label] = StreamingSegments(fps)
+                writers[label] = SegmentWriter(video_path, os.path.join(settings.MEDIA_ROOT, "temp_clips"), f"{job_id}_{label}")
+            def on_settled(new_matches, last_idx):
+                new_by_label = frames_by_label(new_matches)
+                for label in gallery.labels:
+                    timestamps = [idx / fps for idx in new_by_label.get(label, [])]
+                    with stage("group"):
+                        confirmed = groupers[label].add(timestamps, (last_idx + 1) / fps)
+                    writers[label].submit(confirmed)
+            on_faces = on_skip = None
+            if settings.CLIPSNIPER_FACE_INDEX:
+                try:
+                    index_writer = FaceIndexWriter(index_root, digest, fps, total_frames, stride)
+                except OSError as e:
+                    print(f"[WARNING] Job {job_id}: running without the face index: {e}")
+                else:
+                    def on_faces(idx, faces):
+                        nonlocal index_writer
+                        if index_writer is None:
+                            return
+                        try:
+                            index_writer.add(idx, faces)
+                        except OSError as e:
+                            print(f"[WARNING] Job {job_id}: dropping the face index: {e}")
+                            index_writer.discard()
+                            index_writer = None
+                    def on_skip(idx, source_idx):
+                        if index_writer is not None:
+                            index_writer.repeat(idx, source_idx)
+            tracker = FaceTracker() if settings.CLIPSNIPER_FACE_TRACKER else None
+            def report_progress(idx):
+                if idx % 10 == 0:
+                    if total_frames > 0:
+                        status.progress(job_id, int((idx/total_frames)*100))
+                    else:
+                        # Containers without a duration (some WebM/MKV)
+                        # report no frame count: progress is indeterminate.
+                        status.progress(job_id, 0, frames_scanned=idx)
+            match_batch = lambda items: match_frames(
+                get_model(model_root), items, gallery, max_faces=preset["max_faces"], on_faces=on_faces,
+                tracker=tracker, det_size=preset["det_size"], max_height=preset["max_height"])
+            # Static shots carry the last result forward instead of running
+            # the detector on a frame that looks the same.
+            gate = MotionGate(motion_threshold, on_skip=on_skip) if motion_threshold else None
+            if growing:
+                # Frames come from ffmpeg reading the upload as it lands.
+                cap.release()
+                frames = read_growing_frames(upload_id, width, height)
+            else:
+                frames = read_frames(cap)
+            _, frames_inferred = scan_frames(
+                threaded_frames(frames),
+                match_batch,
+                stride=stride,
+                batch_size=batch_size,
+                on_frame=report_progress,
+                on_settled=on_settled,
+                gate=gate,
+            )
+            cap.release()
+            if gate:
+                frames_gated = gate.skipped
+            for label in gallery.labels:
+                writers[label].submit(groupers[label].flush())
+                output_path = writers[label].finish(os.path.join(output_dir, output_filename(job_id, label, multi)))
+                outputs[label] = (groupers[label].segments, output_path)
+            if index_writer:
+                def save():
+                    if index_writer.digest is None:
+                        index_writer.digest = f"{file_sha256(video_path)}-{mode}"
+                    index_writer.save()
+                    enforce_budget(index_root, settings.CLIPSNIPER_FACE_INDEX_MAX_BYTES)
+                save_face_index(job_id, save)
+            if tracker:
+                print(f"[INFO] Job {job_id}: embedded {tracker.embedded} faces, reused {tracker.reused} tracked decisions")
+        print(f"[INFO] Job {job_id}: inferred {frames_inferred}/{total_frames} frames (stride {stride}, {mode} mode, {frames_gated} skipped as static)")
+        elapsed = time.perf_counter() - started
+        FRAMES_INFERRED.inc(frames_inferred)
+        if frames_inferred and elapsed:
+            INFERENCE_FPS.observe(frames_inferred / elapsed)
         del cap
-        del ref_embedding
-        del faces
         gc.collect()
-        resized_path = os.path.join(settings.MEDIA_ROOT, "temp_clips", f"{job_id}_resized.mp4")
-        os.makedirs(os.path.dirname(resized_path), exist_ok=True)
-        subprocess.run([
-            "ffmpeg", "-y", "-i", video_path,
-            "-vf", "scale=iw/2:ih/2",
-            "-c:v", "libx264", "-preset", "ultrafast",
-            "-c:a", "copy",
-            resized_path
-        ], check=True)
-        video_clip = VideoFileClip(resized_path, audio=False)
-        try:
-            w, h = video_clip.size
-            clips = []
-            target_height = 360
-            for i, (start, end) in enumerate(segments):
-                sub = video_clip.subclip(start, end)
-                w, h = sub.size
-                scale = target_height / h
-                sub = sub.resize(height=target_height, width=int(w * scale))
-                clips.append(sub)
-            final = concatenate_videoclips(clips, method="chain")
-            output_dir = os.path.join(settings.MEDIA_ROOT, "output")
-            os.makedirs(output_dir, exist_ok=True)
-            output_path = os.path.join(output_dir, f"{job_id}.mp4")
-            final.write_videofile(output_path, codec="libx264", audio=False, fps=fps)
-            final.close()
-        finally:
-            video_clip.close()
-        atomic_write_json({"done": True, "output_url": f"{settings.MEDIA_URL}output/{job_id}.mp4"}, status_path)
+        people = []
+        for label in gallery.labels:
+            segments, output_path = outputs[label]
+            people.append({
+                "label": label,
+                "segments": [[round(s, 3), round(e, 3)] for s, e in segments],
+                "output_url": f"{settings.MEDIA_URL}output/{os.path.basename(output_path)}" if output_path else None,
+            })
+        output_paths = [output_path for _, output_path in outputs.values() if output_path]
+        if not output_paths:
+            print("[WARNING] No matching segments found.")
+            status.finish(job_id, {"done": False, "output_url": None, "message": "No matching clips found", "frames_inferred": frames_inferred, "frames_gated": frames_gated})
+            if cache_key:
+                schedule_deletion(store_result(cache_key, job_id, []))
+            return
+        output_url = next(person["output_url"] for person in people if person["output_url"])
+        status.finish(job_id, {"done": True, "output_url": output_url, "people": people, "frames_inferred": frames_inferred, "frames_gated": frames_gated})
         try:
-            os.remove(resized_path)
             os.remove(video_path)
-            os.remove(image_path)
-            del sub 
-            del clips 
-            del final
-            gc.collect()
+            if upload_id:
+                delete_upload(upload_id)
+            for _, image_paths, _ in references:
+                for image_path in image_paths:
+                    os.remove(image_path)
         except Exception as cleanup_err:
             print(f"[WARNING] Failed to delete temp files for job {job_id}: {cleanup_err}")
-        delete_after_delay(output_path, status_path, delay_seconds=3600)
+        expiring = list(output_paths)
+        if cache_key:
+            expiring.append(store_result(cache_key, job_id, output_paths))
+        schedule_deletion(*expiring)
     except Exception as e:
         print(e)
+        # Lets clients that wait for progress stop waiting.
+        status.finish(job_id, {"done": False, "error": str(e)})
+    finally:
+        if cache_key:
+            release(cache_key)
+        if upload_id:
+            # A failed job leaves the upload for a retry; a finished one has
+            # already deleted it.
+            release_upload(upload_id)
+        for writer in writers.values():
+            writer.cleanup()
+        if index_writer:
+            # No-op once saved; otherwise drops the partial index.
+            index_writer.discard()
 
-def atomic_write_json(data, path):
-    tmp_path = path + ".tmp"
-    with open(tmp_path, 'w') as f:
-        json.dump(data, f)
-    os.replace(tmp_path, path)
+def parse_int(value, default, lo, hi):
+    try:
+        return max(lo, min(int(value), hi))
+    except (TypeError, ValueError):
+        return default
 
-def clipsniper_demo(request):
-    job_id = request.GET.get("job_id")
+def parse_float(value, default, lo, hi):
+    try:
+        return max(lo, min(float(value), hi))
+    except (TypeError, ValueError):
+        return default
+
+def reference_uploads(request, default_threshold):
+    # Photos in "image" belong to the default person; "image_<label>" fields
+    # add more people. "threshold" / "threshold_<label>" override the
+    # similarity threshold per person.
+    people = []
+    images = request.FILES.getlist('image')[:MAX_REFERENCE_IMAGES]
+    if images:
+        threshold = parse_float(request.POST.get('threshold'), default_threshold, 0.1, 0.95)
+        people.append(("person", images, threshold))
+    for field in request.FILES:
+        if not field.startswith('image_'):
+            continue
+        label = slugify(field[len('image_'):])[:32]
+        if not label or label == "person" or label in [p[0] for p in people]:
+            continue
+        threshold = parse_float(request.POST.get(f'threshold_{field[len("image_"):]}'), default_threshold, 0.1, 0.95)
+        people.append((label, request.FILES.getlist(field)[:MAX_REFERENCE_IMAGES], threshold))
+    return people
+
+@csrf_protect
+def submit_clipsniper_job(request, is_staff):
+    # Sync half of the upload view: parsing the multipart body, hashing the
+    # files and saving them are disk and CPU work, so the async view runs
+    # this in a worker thread. The CSRF check is made here rather than by
+    # the middleware because it reads request.POST, which would parse the
+    # body on the one thread Django shares between every sync call.
     context = {}
-    if request.method == 'POST':
-        video = request.FILES.get('video')
-        image = request.FILES.get('image')
-        if not video or not image:
-            context['error'] = "Both video and image are required."
-            return render(request, 'project_demo.html', context)
-        if video and video.size > MAX_UPLOAD_SIZE:
-            return HttpResponse("Video file is too large (max 25 MB allowed).", status=400)
-        job_id = str(uuid.uuid4())
+    video = request.FILES.get('video')
+    # Large videos arrive through the chunked upload API instead, and the
+    # job may be started before the upload has finished.
+    upload_id = request.POST.get('upload_id')
+    mode = request.POST.get('mode') or DEFAULT_MODE
+    if mode not in PRESETS:
+        return HttpResponse(f"Unknown mode. Choose one of: {', '.join(PRESETS)}.", status=400)
+    people = reference_uploads(request, PRESETS[mode]["threshold"])
+    if not (video or upload_id) or not people:
+        context['error'] = "Both video and image are required."
+        return render(request, 'project_demo.html', context)
+    if upload_id and upload_meta(upload_id) is None:
+        return HttpResponse("Unknown upload.", status=400)
+    if video and video.size > MAX_UPLOAD_SIZE:
+        return HttpResponse("Video file is too large (max 25 MB allowed).", status=400)
+    if len(people) > MAX_PEOPLE:
+        return HttpResponse(f"At most {MAX_PEOPLE} people per job.", status=400)
+    stride = parse_int(request.POST.get('stride'), DEFAULT_SCAN_STRIDE, 1, MAX_SCAN_STRIDE)
+    stride_ms = parse_int(request.POST.get('stride_ms'), None, 1, 10000)
+    # Batch size trades memory for throughput, so only staff may change it.
+    batch_size = DEFAULT_BATCH_SIZE
+    if is_staff:
+        batch_size = parse_int(request.POST.get('batch_size'), DEFAULT_BATCH_SIZE, 1, MAX_BATCH_SIZE)
+    job_id = str(uuid.uuid4())
+    if upload_id:
+        try:
+            claim_upload(upload_id, job_id)
+        except UploadInUse as e:
+            return HttpResponse(str(e), status=409)
+        # An upload that is still arriving cannot be hashed, so it skips
+        # the result cache.
+        video_digest = file_sha256(upload_path(upload_id)) if is_complete(upload_id) else None
+    else:
+        video_digest = hash_upload(video)
+    cache_key = None
+    if video_digest:
+        cache_key = job_key(
+            video_digest,
+            [(label, [hash_upload(image) for image in images], threshold) for label, images, threshold in people],
+            {"stride": stride, "stride_ms": stride_ms, "mode": mode},
+        )
+        existing = claim(cache_key, job_id)
+        if existing != job_id:
+            # Same video, photos and parameters: hand back the finished or
+            # running job instead of processing the upload again.
+            if upload_id:
+                delete_upload(upload_id)
+            return JsonResponse({"job_id": existing})
+    if upload_id:
+        video_full = upload_path(upload_id)
+    else:
         video_path = default_storage.save(f'temp/{job_id}_video.mp4', video)
-        image_path = default_storage.save(f'temp/{job_id}_image.jpg', image)
         video_full = os.path.join(settings.MEDIA_ROOT, video_path)
-        image_full = os.path.join(settings.MEDIA_ROOT, image_path)
-        threading.Thread(target=process_video_job, args=(job_id, video_full, image_full)).start()
+    references = []
+    for label, images, threshold in people:
+        image_paths = []
+        for i, image in enumerate(images):
+            image_path = default_storage.save(f'temp/{job_id}_{label}_{i}.jpg', image)
+            image_paths.append(os.path.join(settings.MEDIA_ROOT, image_path))
+        references.append((label, image_paths, threshold))
+    job = {
+        "job_id": job_id, "video_path": video_full, "references": references, "priority": 0 if is_staff else 1,
+        "options": {
+            "stride": stride, "stride_ms": stride_ms, "batch_size": batch_size, "video_digest": video_digest,
+            "cache_key": cache_key, "mode": mode, "upload_id": upload_id,
+            "profile": is_staff and request.POST.get('profile') == '1',
+        },
+    }
+    if upload_id and not upload_ready(upload_id):
+        # Queued by upload_chunk once enough of the video has arrived, so
+        # the job does not hold a worker while the client is still sending.
+        get_status_store().set(job_id, {"done": False, "progress": 0, "waiting_for_upload": True})
+        park_job(upload_id, job)
+        start_parked_job(upload_id)
         return JsonResponse({"job_id": job_id})
+    try:
+        start_job(job)
+    except QueueFull:
+        if cache_key:
+            release(cache_key)
+        # A chunked upload is kept so the client can retry with it.
+        temp_paths = [p for _, paths, _ in references for p in paths]
+        if upload_id:
+            release_upload(upload_id)
+        else:
+            temp_paths.append(video_full)
+        for path in temp_paths:
+            os.remove(path)
+        return HttpResponse("Too many videos are being processed right now. Please try again in a few minutes.", status=429)
+    return JsonResponse({"job_id": job_id})
+
+def start_job(job):
+    scheduler.submit(job["job_id"], process_video_job, job["job_id"], job["video_path"], job["references"],
+                     priority=job["priority"], **job["options"])
+
+def start_parked_job(upload_id):
+    # Queues the job parked on this upload if the upload has become ready.
+    job = take_parked_job(upload_id)
+    if job is None:
+        return
+    try:
+        start_job(job)
+    except QueueFull:
+        # The client is past the point of retrying the submission, so the
+        # refusal is reported through the job's status instead; the upload
+        # is free for a new submission.
+        release_upload(upload_id)
+        get_status_store().finish(job["job_id"], {
+            "done": False, "error": "Too many videos are being processed right now. Please try again in a few minutes.",
+        })
+
+async def upload_create(request):
+    # POST size=<bytes>&filename=<name> -> {"upload_id", "offset", "chunk_size"}
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({"error": "size required"}, status=400)
+    if size <= 0 or size > settings.CLIPSNIPER_MAX_CHUNKED_UPLOAD_SIZE:
+        limit_mb = settings.CLIPSNIPER_MAX_CHUNKED_UPLOAD_SIZE // (1024 * 1024)
+        return JsonResponse({"error": f"Video must be at most {limit_mb} MB."}, status=413)
+    try:
+        upload_id = await asyncio.to_thread(
+            create_upload, size, request.POST.get('filename', '')[:255], client=request.META.get('REMOTE_ADDR', ''),
+            max_per_client=settings.CLIPSNIPER_MAX_UPLOADS_PER_CLIENT,
+            max_active_bytes=settings.CLIPSNIPER_MAX_ACTIVE_UPLOAD_BYTES)
+    except UploadLimit as e:
+        return JsonResponse({"error": str(e)}, status=429)
+    return JsonResponse({"upload_id": upload_id, "offset": 0, "chunk_size": CHUNK_SIZE}, status=201)
+
+async def upload_chunk(request, upload_id):
+    # GET reports how much has arrived, so an interrupted client knows where
+    # to resume. PUT appends the request body at the Upload-Offset header,
+    # which must equal the current offset (409 with the real one otherwise).
+    meta = await asyncio.to_thread(upload_meta, upload_id)
+    if meta is None:
+        return JsonResponse({"error": "Unknown upload."}, status=404)
+    if request.method == 'GET':
+        offset = await asyncio.to_thread(upload_offset, upload_id)
+        return JsonResponse({"offset": offset, "size": meta["size"], "complete": offset >= meta["size"]})
+    if request.method not in ('PUT', 'PATCH'):
+        return JsonResponse({"error": "GET or PUT required"}, status=405)
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length', ''))
+    except ValueError:
+        return JsonResponse({"error": "Upload-Offset and Content-Length required"}, status=400)
+    if length > MAX_CHUNK_SIZE:
+        return JsonResponse({"error": f"Chunks must be at most {MAX_CHUNK_SIZE} bytes."}, status=413)
+    try:
+        offset = await asyncio.to_thread(append_chunk, upload_id, offset, request, length)
+    except OffsetMismatch as e:
+        return JsonResponse({"error": str(e), "offset": e.offset}, status=409)
+    except UploadError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    await asyncio.to_thread(start_parked_job, upload_id)
+    return JsonResponse({"offset": offset, "size": meta["size"], "complete": offset >= meta["size"]})
+
+def clipsniper_page(request):
+    job_id = request.GET.get("job_id")
+    context = {}
     if job_id:
-        status_path = os.path.join(settings.MEDIA_ROOT, "status", f"{job_id}.json")
-        if os.path.exists(status_path):
-            with open(status_path) as f:
-                data = json.load(f)
+        data = get_status_store().get(job_id)
+        if data is not None:
             if data.get("done"):
                 context["output_url"] = data["output_url"]
+                context["people"] = data.get("people", [])
             else:
                 context["error"] = "Video is not ready yet."
         else:
             context["error"] = "Invalid job ID."
         return render(request, 'clipsniper_demo.html', context)
     else:
+        context['max_video_size'] = settings.CLIPSNIPER_MAX_CHUNKED_UPLOAD_SIZE
         return render(request, 'project_demo.html', context)
-    
-def check_status(request):
+
+@csrf_exempt
+async def clipsniper_demo(request):
+    # CSRF is checked by submit_clipsniper_job, in its worker thread.
+    if request.method == 'POST':
+        # Under ASGI the body has already been read into a spooled temp file
+        # without blocking the loop; parsing it and everything after that
+        # runs in a worker thread.
+        user = await request.auser()
+        return await asyncio.to_thread(submit_clipsniper_job, request, user.is_staff)
+    return await sync_to_async(clipsniper_page)(request)
+
+async def check_status(request):
     job_id = request.GET.get("job_id")
     if not job_id:
         return JsonResponse({"error": "job_id required"}, status=400)
-    status_path = os.path.join(settings.MEDIA_ROOT, "status", f"{job_id}.json")
-    if not os.path.exists(status_path):
-        print("No Status Path")
-        return JsonResponse({"done": False, "progress": 0})
     try:
-        if os.path.getsize(status_path) == 0:
-            print("Empty status file")
-            return JsonResponse({"done": False, "progress": 0})
-        with open(status_path) as f:
-            data = json.load(f)
-        return JsonResponse(data)
-    except json.JSONDecodeError:
-        print("[ERROR] Corrupted or incomplete JSON")
-        return JsonResponse({"done": False, "progress": 0})
+        return JsonResponse(await asyncio.to_thread(job_status, job_id))
     except Exception as e:
         print(f"[ERROR] check_status failed: {e}")
         return JsonResponse({"error": str(e)}, status=500)
 
-def delete_after_delay(*paths, delay_seconds=3600):
-    def delete_file():
-        time.sleep(delay_seconds)
-        for path in paths:
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except Exception as e:
-                print(f"[WARNING] Could not delete {path}: {e}")
-    threading.Thread(target=delete_file, daemon=True).start()
+def metrics(request):
+    # Prometheus text format. Open to staff sessions and to scrapers that
+    # send CLIPSNIPER_METRICS_TOKEN as a bearer token.
+    token = settings.CLIPSNIPER_METRICS_TOKEN
+    if not (request.user.is_staff or (token and request.headers.get("Authorization") == f"Bearer {token}")):
+        return HttpResponse(status=404)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")